@@ -1 +1,4 @@
-from .feature import Features
\ No newline at end of file
+from .feature import Features
+from .pixel_features import PixelFeatures
+from .region_stats import RegionStats
+from .boundary import Boundary
\ No newline at end of file
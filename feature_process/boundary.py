@@ -0,0 +1,73 @@
+import numpy as np
+
+# (dy, dx) of the 8 neighbours, in the order boundary samples are taken
+DIRECTS = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+
+def get_boundary(rmat):
+    """
+    Find every pixel next to a pixel of another region (8 directions).
+    return:
+        - p, q: flat index (y * width + x) of the pixel and of its neighbour,
+                sorted by p and then by direction.
+    """
+    height, width = rmat.shape
+    edge = np.zeros([height, width, 8], dtype=bool)
+    for d, (dy, dx) in enumerate(DIRECTS):
+        p = (slice(max(0, -dy), height - max(0, dy)),
+             slice(max(0, -dx), width - max(0, dx)))
+        q = (slice(max(0, dy), height - max(0, -dy)),
+             slice(max(0, dx), width - max(0, -dx)))
+        edge[p + (d,)] = rmat[p] != rmat[q]
+    p, d = np.nonzero(edge.reshape(-1, 8))
+    dy, dx = np.array(DIRECTS).T
+    q = p + dy[d] * width + dx[d]
+    return p, q
+
+
+class Boundary():
+    """Boundary samples of the regions and the sparse region adjacency.
+
+    A sample is a pixel of region i next to a pixel (y, x) of region j, one
+    for each of the 8 directions. Everything is ordered like a scan of region
+    i's pixels (row by row, then direction), so neighbours come in the order
+    they are first met.
+
+    Attributes:
+        p, q: flat index of every sample's two pixels, see get_boundary.
+        adj_offsets: np( [num of regions + 1] ), CSR offsets into adj_i / adj_j.
+        adj_i, adj_j: np( [num of adjacent pairs] ), the pair (i, j), sorted by
+                      i and then by first met.
+        pair_offsets: np( [num of adjacent pairs + 1] ), CSR offsets into y / x.
+        y, x: np( [num of samples] ), the coordinates of every sample's pixel
+              of region j, grouped by pair.
+    """
+
+    def __init__(self, rmat, num_reg):
+        width = rmat.shape[1]
+        labels = rmat.reshape(-1)
+        self.p, self.q = get_boundary(rmat)
+        region = labels[self.p]
+        order = np.argsort(region, kind="stable")
+        region, q = region[order], self.q[order]
+        neigh = labels[q]
+        _, first, inverse = np.unique(
+            region.astype(np.int64) * num_reg + neigh,
+            return_index=True, return_inverse=True)
+        # samples are sorted by region, so are the first ones of the pairs
+        pair_order = np.argsort(first)
+        rank = np.zeros(len(first), dtype=np.int64)
+        rank[pair_order] = np.arange(len(first))
+        pair = rank[inverse.reshape(-1)]
+        self.adj_i = region[first[pair_order]]
+        self.adj_j = neigh[first[pair_order]]
+        self.adj_offsets = np.zeros(num_reg + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.adj_i, minlength=num_reg),
+                  out=self.adj_offsets[1:])
+        self.pair_offsets = np.zeros(len(first) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair, minlength=len(first)),
+                  out=self.pair_offsets[1:])
+        self.y, self.x = np.divmod(q[np.argsort(pair, kind="stable")], width)
+
+    def neighs(self, i):
+        return self.adj_j[self.adj_offsets[i]:self.adj_offsets[i + 1]]
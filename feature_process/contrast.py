@@ -0,0 +1,52 @@
+import numpy as np
+
+# memory cap of one block of contrast features
+BLOCK_BYTES = 32 * 2**20
+
+
+def row_blocks(num_rows, row_bytes, block_bytes=BLOCK_BYTES):
+    """
+    Split num_rows rows of row_bytes bytes each into blocks under block_bytes.
+    yield:
+        - rows: slice of the rows of the block
+    """
+    step = max(1, block_bytes // max(1, row_bytes))
+    for s in range(0, num_rows, step):
+        yield slice(s, min(s + step, num_rows))
+
+
+def presence_chi(p, q, n_p, n_q):
+    """
+    Chi-square distances between every histogram of p and every one of q.
+
+    The histograms are 2 in the bins whose value shows up in the region and 1
+    elsewhere, so every bin where two regions differ adds 2 * 1 / (1 + 2 + 1):
+        sum(2 * (h_i - h_j)**2 / (h_i + h_j + 1)) = (n_i + n_j - 2 * p_i . p_j) / 2
+    with p the 0/1 presence and n its sum, i.e. one matrix product.
+    Products of 0/1 values are exact in float32 too.
+    args:
+        - p, q: np( [num of regions, bins] ), 0/1 presence of the values.
+        - n_p, n_q: np( [num of regions] ), the sums of p and q.
+    return:
+        - np( [len(p), len(q)] )
+    """
+    block = p.dot(q.T)
+    block *= -2
+    block += n_p[:, None]
+    block += n_q
+    block *= 0.5
+    return block
+
+
+def pair_presence_chi(p, q, n_p, n_q):
+    """
+    The same as presence_chi, between p[k] and q[k] only.
+    return:
+        - np( [len(p)] )
+    """
+    block = np.sum(p * q, axis=1)
+    block *= -2
+    block += n_p
+    block += n_q
+    block *= 0.5
+    return block
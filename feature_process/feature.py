@@ -1,35 +1,73 @@
-import cv2
-import copy
 import numpy as np
 
+from .boundary import Boundary
+from .pixel_features import PixelFeatures
+from .region_stats import RegionStats
 from .utils import Utils
 
 
 class Features():
-    """Generate img features useing reagions lists and regions mat.
+    """Generate img features useing regions.
 
-    Use the reagions lists and regions mat to generate 93-dim features and 222-dim features.
+    Use the regions (label map and its index) to generate 93-dim features and 222-dim features.
 
     Attributes:
         features93: A 93-dim features used to generate salience map. 
                     Which shape is [Num of regions, 93]
-        comb_features(optional):  A 222-dim features used to combine regions.
+        comb_features(optional):  A 222-dim features used to combine regions,
+                    one row for every adjacent pair of regions (comb_i, comb_j).
+                    Which shape is [Num of adjacent pairs, 222]
+        comb_i, comb_j(optional): the region ids of every row of comb_features,
+                    sorted by comb_i.
     """
 
-    def __init__(self, path, rlist, rmat, need_comb_features=True):
-        self.rgb = cv2.imread(path)
-        self.rlist = rlist
-        _list = copy.deepcopy(rlist)
-        _list.append(Utils.get_background(
-            self.rgb.shape[0], self.rgb.shape[1]))
-        self.utils = Utils(self.rgb, _list, rmat, need_comb_features)
-        self.features29 = self.get_29_features()
+    def __init__(self, img, regions, need_comb_features=True, pixels=None,
+                 stats=None):
+        """
+        args:
+            - img: the Img_Context of the img.
+            - regions: the Regions of the img.
+            - pixels: the PixelFeatures of the img, pass the same one to every
+                      segmentation level of an img to compute it only once.
+            - stats: the RegionStats of the regions, see combine.
+        """
+        self.img = img
+        self.regions = regions
+        boundary = None
+        if need_comb_features:
+            boundary = Boundary(regions.rmat, len(regions))
+        if stats is None:
+            if pixels is None:
+                pixels = PixelFeatures(img)
+            height, width = regions.rmat.shape
+            ys, xs = Utils.get_background(height, width)
+            stats = RegionStats.from_pixels(
+                pixels, regions, [ys * width + xs], boundary)
+        self.stats = stats
+        self.utils = Utils(stats, regions, need_comb_features, boundary)
+        # the background is the last region
+        self.contrast_sums = self.utils.get_contrast_sums()
+        self.bkg_contrast = self.utils.get_contrast(slice(-1, None))[:, 0]
         self.features93 = self.get_features93()
         if need_comb_features:
+            self.comb_i = boundary.adj_i
+            self.comb_j = boundary.adj_j
             self.comb_features = self.get_combine_features()
 
+    def combine(self, regions):
+        """
+        Features(93-dim) of combined regions, like the levels of
+        Super_Region.combine_regions. They are computed from the statistics of
+        the regions they are combined from, without scanning the pixels again.
+        args:
+            - regions: the combined Regions, with regions.trans_array
+        """
+        stats = self.stats.merge(regions.trans_array, len(regions))
+        return Features(self.img, regions, need_comb_features=False,
+                        stats=stats)
+
     def get_features93(self):
-        num_reg = len(self.rlist)
+        num_reg = len(self.regions)
         features93 = np.zeros([num_reg, 93])
         features93[:, :35] = self.get_region_features()
         features93[:, 35:35+29] = self.get_contrast_features()
@@ -37,7 +75,7 @@ class Features():
         return features93
 
     def get_region_features(self):
-        num_reg = len(self.rlist)
+        num_reg = len(self.regions)
         reg_features = np.zeros([num_reg, 35])
         reg_features[:, 0:6] = self.utils.coord[:-1, 0:6]
         reg_features[:, 6] = self.utils.edge_nums[:-1]
@@ -50,44 +88,21 @@ class Features():
         return reg_features
 
     def get_contrast_features(self):
-        con_features = np.sum(self.features29, axis=1)[
-            :, :-1] / len(self.rlist)
+        con_features = self.contrast_sums[:, :-1] / len(self.regions)
         con_features = con_features.T
         return con_features
 
     def get_background_features(self):
-        bkg_features = self.features29[:, -1, :-1]
+        bkg_features = self.bkg_contrast[:, :-1]
         bkg_features = bkg_features.T
         return bkg_features
 
     def get_combine_features(self):
-        edge_ids = self.utils.edge_neigh
-        num_reg = len(self.rlist)
-        comb_features = [{"i_id": i, "j_ids": [], "features":[]}
-                         for i in range(num_reg)]
-        for i in range(num_reg):
-            ids = edge_ids[i]
-            features = np.zeros([222, len(ids)])
-            features[:93] = np.repeat(
-                self.features93[i], len(ids)).reshape(93, -1)
-            features[93:186] = self.features93[ids].T
-            features[186:186+29] = self.features29[:, i, ids]
-            features[215:] = self.utils.edge_prop[i, ids, :].T
-            comb_features[i]["j_ids"] = ids
-            comb_features[i]["features"] = features.T
+        i, j = self.comb_i, self.comb_j
+        comb_features = np.zeros([len(i), 222])
+        comb_features[:, :93] = self.features93[i]
+        comb_features[:, 93:186] = self.features93[j]
+        # only the adjacent pairs are needed
+        comb_features[:, 186:186+29] = self.utils.get_pair_contrast(i, j).T
+        comb_features[:, 215:] = self.utils.edge_prop
         return comb_features
-
-    def get_29_features(self):
-        num_reg = len(self.rlist)
-        features = np.zeros([29, num_reg+1, num_reg+1])
-        dot = self.utils.dot
-        for i in range(9):
-            features[i] = dot(self.utils.color_avg[:, i])
-        features[9] = dot(self.rgb, hist=True)
-        features[10] = dot(self.utils.hsv, hist=True)
-        features[11] = dot(self.utils.lab, hist=True)
-        for i in range(15):
-            features[i+12] = dot(self.utils.tex_avg[:, i])
-        features[27] = dot(self.utils.tex, hist=True)
-        features[28] = dot(np.int16(self.utils.lbp), hist=True)
-        return features
@@ -0,0 +1,65 @@
+from functools import lru_cache
+
+import cv2
+import numpy as np
+from skimage.feature import local_binary_pattern
+
+from .LM_filters import makeLMfilters
+
+# dtype of the texture responses, np.float64 gives the baseline features,
+# np.float32 is faster but moves a few pixels to the next of the 256 levels
+TEX_DTYPE = np.float64
+
+
+@lru_cache(maxsize=None)
+def ml_kernels():
+    """
+    The 15 LM filters used for texture, built once per process.
+    return:
+        - np( [15, 49, 49] ), read only
+    """
+    ml_filters = makeLMfilters()[:, :, 0:15]
+    ml_filters = np.ascontiguousarray(ml_filters.transpose(2, 0, 1))
+    ml_filters.setflags(write=False)
+    return ml_filters
+
+
+class PixelFeatures():
+    """Per-pixel channel maps of one img.
+
+    They only depend on the img, not on the regions, so compute them once and
+    share them by every Features of the img (all segmentation levels).
+
+    Attributes:
+        rgb, lab, hsv: color planes, np( [height, width, 3] ).
+        imgchan: rgb, lab and hsv stacked, np( [height, width, 9] ).
+        tex: 15 LM filter responses scaled to 0~255, np( [height, width, 15] ).
+        lbp: local binary pattern, np( [height, width, 1] ).
+    """
+
+    def __init__(self, img):
+        self.img = img
+        self.rgb, self.lab, self.hsv = img.rgb, img.lab, img.hsv
+        self.imgchan = np.concatenate([self.rgb, self.lab, self.hsv], axis=2)
+        self.tex = self.get_tex()
+        self.lbp = self.get_lbp()
+
+    def get_tex(self):
+        kernels = ml_kernels().astype(TEX_DTYPE)
+        ddepth = cv2.CV_64F if TEX_DTYPE == np.float64 else cv2.CV_32F
+        gray = self.img.gray.astype(TEX_DTYPE) / TEX_DTYPE(255.0)
+        tex = np.zeros([gray.shape[0], gray.shape[1], 15], dtype=TEX_DTYPE)
+        for i in range(15):
+            tex[:, :, i] = cv2.filter2D(gray, ddepth, kernels[i])
+        for i in range(15):
+            tex_max = np.max(tex[:, :, i])
+            tex_min = np.min(tex[:, :, i])
+            tex[:, :, i] = (tex[:, :, i] - tex_min)/(tex_max - tex_min) * 255
+        tex = tex.astype(np.int32)
+        return tex
+
+    def get_lbp(self):
+        lbp = local_binary_pattern(self.img.gray, 8, 1.).astype(np.int32)
+        _lbp = np.zeros((lbp.shape[0], lbp.shape[1], 1))
+        _lbp[:, :, 0] = lbp
+        return _lbp
@@ -0,0 +1,200 @@
+import numpy as np
+
+from .boundary import get_boundary
+
+HIST_BINS = 256
+
+
+def count_pairs(i, j, num, weights=None):
+    """
+    Sum duplicated (i, j) pairs.
+    return:
+        - i, j, count: unique pairs sorted by i then j
+    """
+    code, inverse = np.unique(
+        np.asarray(i, dtype=np.int64) * num + j, return_inverse=True)
+    count = np.bincount(inverse.reshape(-1), weights=weights)
+    return code // num, code % num, count
+
+
+def _compact(counts):
+    if counts.size == 0:
+        return counts
+    return counts.astype(np.min_scalar_type(counts.max()))
+
+
+class RegionStats():
+    """Mergeable sufficient statistics of every region.
+
+    from_pixels builds them by segmented reductions over the label map, each
+    one a np.bincount over all pixels, so the cost is O(pixels x channels) with
+    no loop over regions. Everything kept is a sum over pixels, so the
+    statistics of a combined level are sums of its regions' statistics (merge),
+    which costs O(regions) instead of O(pixels).
+
+    Extra regions, which may overlap the label map (like the background), get
+    the ids after the regions and stay as they are when merging.
+
+    Attributes:
+        num: number of regions, extra ones included.
+        num_extra: number of extra regions.
+        counts: np( [num] ), pixels in every region.
+        hist_y: np( [num, height] ), pixels of every region on each row.
+        hist_x: np( [num, width] ), pixels of every region on each column.
+        sums: {name: (sum, sum of squares)}, np( [num, channels] ) each.
+        hists: {name: np( [num, 256] )}, times each value shows up in every
+               region, over all the channels.
+        edge_pairs: (i, j, count), boundary samples (a pixel of region i next to
+                    a pixel of region j) of every adjacent pair.
+        extra_edges: [(i, j, count)], the same for the pixels of each extra region,
+                     i and j are the label map ids of both pixels.
+    """
+
+    def __init__(self, height, width, counts, hist_y, hist_x, sums, hists,
+                 edge_pairs, extra_edges):
+        self.height, self.width = height, width
+        self.num = len(counts)
+        self.num_extra = len(extra_edges)
+        self.counts = counts
+        self.hist_y, self.hist_x = hist_y, hist_x
+        self.sum_y = hist_y.dot(np.arange(height))
+        self.sum_x = hist_x.dot(np.arange(width))
+        self.sums = sums
+        self.hists = hists
+        self.edge_pairs = edge_pairs
+        self.extra_edges = extra_edges
+
+    def __getstate__(self):
+        # the histograms are counts, pickled in the smallest dtype that holds
+        # them (mostly uint16 instead of int64)
+        state = dict(self.__dict__)
+        state["hist_y"] = _compact(self.hist_y)
+        state["hist_x"] = _compact(self.hist_x)
+        state["hists"] = {k: _compact(h) for k, h in self.hists.items()}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.hist_y = self.hist_y.astype(np.int64)
+        self.hist_x = self.hist_x.astype(np.int64)
+        self.hists = {k: h.astype(np.int64) for k, h in self.hists.items()}
+
+    @staticmethod
+    def from_pixels(pixels, regions, extra=(), boundary=None):
+        """
+        args:
+            - pixels: the PixelFeatures of the img.
+            - regions: the Regions of the img.
+            - extra: flat pixel indices of every extra region.
+            - boundary: the Boundary of the regions, if it is already known.
+        """
+        height, width = regions.rmat.shape
+        labels = regions.rmat.reshape(-1)
+        num = len(regions) + len(extra)
+        index = [labels]
+        pixel = [np.arange(height * width)]
+        for k, e in enumerate(extra):
+            index.append(np.full(len(e), len(regions) + k, dtype=np.int32))
+            pixel.append(np.asarray(e))
+        index = np.concatenate(index).astype(np.int64)
+        pixel = np.concatenate(pixel)
+
+        def count_by(values, bins):
+            hist = np.bincount(index * bins + values, minlength=num * bins)
+            return hist.reshape(num, bins)
+
+        def get_sums(a):
+            a = a.reshape(height * width, -1)
+            s = np.zeros([num, a.shape[1]])
+            sq = np.zeros([num, a.shape[1]])
+            for j in range(a.shape[1]):
+                v = a[:, j].astype(np.float64)[pixel]
+                s[:, j] = np.bincount(index, weights=v, minlength=num)
+                sq[:, j] = np.bincount(index, weights=v*v, minlength=num)
+            return s, sq
+
+        def get_hist(a):
+            a = a.reshape(height * width, -1)
+            hist = np.zeros([num, HIST_BINS], dtype=np.int64)
+            for j in range(a.shape[1]):
+                hist += count_by(a[:, j].astype(np.int64)[pixel], HIST_BINS)
+            return hist
+
+        counts = np.bincount(index, minlength=num)
+        ys, xs = np.divmod(pixel, width)
+        sums = {"color": get_sums(pixels.imgchan),
+                "tex": get_sums(pixels.tex),
+                "lbp": get_sums(pixels.lbp)}
+        hists = {"rgb": get_hist(pixels.rgb),
+                 "hsv": get_hist(pixels.hsv),
+                 "lab": get_hist(pixels.lab),
+                 "tex": get_hist(pixels.tex),
+                 "lbp": get_hist(pixels.lbp)}
+        if boundary is None:
+            p, q = get_boundary(regions.rmat)
+        else:
+            p, q = boundary.p, boundary.q
+        edge_pairs = count_pairs(labels[p], labels[q], len(regions))
+        extra_edges = []
+        for e in extra:
+            in_extra = np.zeros(height * width, dtype=bool)
+            in_extra[e] = True
+            _p, _q = p[in_extra[p]], q[in_extra[p]]
+            extra_edges.append(count_pairs(
+                labels[_p], labels[_q], len(regions)))
+        return RegionStats(height, width, counts, count_by(ys, height),
+                           count_by(xs, width), sums, hists, edge_pairs,
+                           extra_edges)
+
+    def merge(self, trans_array, num_reg):
+        """
+        The statistics of combined regions.
+        args:
+            - trans_array: np( [num of regions] ), the combined id of every region.
+            - num_reg: number of combined regions.
+        """
+        num = num_reg + self.num_extra
+        trans = np.concatenate(
+            [trans_array, num_reg + np.arange(self.num_extra)])
+
+        def group(x):
+            _x = np.zeros((num,) + x.shape[1:], dtype=x.dtype)
+            np.add.at(_x, trans, x)
+            return _x
+
+        def group_pairs(pairs):
+            i, j, count = trans_array[pairs[0]], trans_array[pairs[1]], pairs[2]
+            outer = i != j
+            return count_pairs(i[outer], j[outer], num_reg, count[outer])
+
+        sums = {k: (group(s), group(sq)) for k, (s, sq) in self.sums.items()}
+        hists = {k: group(h) for k, h in self.hists.items()}
+        return RegionStats(self.height, self.width, group(self.counts),
+                           group(self.hist_y), group(self.hist_x), sums, hists,
+                           group_pairs(self.edge_pairs),
+                           [group_pairs(e) for e in self.extra_edges])
+
+    def avg_var(self, name):
+        n = self.counts.reshape(-1, 1).astype(np.float64)
+        s, sq = self.sums[name]
+        avg = s / n
+        var = np.maximum(sq / n - avg**2, 0.)
+        return avg, var
+
+    def edge_nums(self):
+        """
+        Boundary samples of every region.
+        """
+        i, j, count = self.edge_pairs
+        nums = np.bincount(i, weights=count, minlength=self.num)
+        for k, (i, j, count) in enumerate(self.extra_edges):
+            nums[self.num - self.num_extra + k] = np.sum(count)
+        return nums
+
+    @staticmethod
+    def kth(hist, k):
+        """
+        The k-th smallest value of every row of a histogram, k is 0-based.
+        """
+        cum = np.cumsum(hist, axis=1)
+        return np.sum(cum <= np.reshape(k, [-1, 1]), axis=1)
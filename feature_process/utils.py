@@ -1,266 +1,219 @@
-import cv2
 import numpy as np
-from skimage.feature import local_binary_pattern
 
-from .LM_filters import makeLMfilters
+from .contrast import pair_presence_chi, presence_chi, row_blocks
 
 RATIO_C = 0.2
 A_C = 50.
 NEIGH_AREAS_C = 0.1
 EDGE_NEIGH = 1000
+# np.float32 halves the memory of the histogram presence, distances stay exact
+HIST_DTYPE = np.float64
 
 
 class Utils():
 
-    def __init__(self, rgb, rlist, rmat, need_comb_features=True):
-        self.height, self.width = rmat.shape
-        self.rgb, self.rlist, self.rmat = rgb, rlist, rmat
-        self.lab = cv2.cvtColor(rgb, cv2.COLOR_RGB2Lab)
-        self.hsv = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV)
-        self.tex = self.get_tex()
-        self.lbp = self.get_lbp()
+    def __init__(self, stats, regions, need_comb_features=True, boundary=None):
+        """
+        args:
+            - stats: the RegionStats of the regions, the background (img border)
+                     is the last region, it overlaps the others.
+            - regions: the Regions of the img.
+            - boundary: the Boundary of the regions, needed by the combine features.
+        """
+        self.height, self.width = regions.rmat.shape
+        self.rmat = regions.rmat
+        self.stats = stats
         self.coord = self.get_coord()
-        imgchan = np.concatenate([self.rgb, self.lab, self.hsv], axis=2)
-        self.color_avg, self.color_var = self.get_avg_var(imgchan)
-        self.tex_avg, self.tex_var = self.get_avg_var(self.tex)
-        self.lbp_avg, self.lbp_var = self.get_avg_var(self.lbp)
-        self.edge_nums, self.edge_neigh, self.edge_point = self.get_edges(
-            need_comb_features)
+        self.color_avg, self.color_var = self.get_avg_var("color")
+        self.tex_avg, self.tex_var = self.get_avg_var("tex")
+        self.lbp_avg, self.lbp_var = self.get_avg_var("lbp")
+        self.edge_nums = self.get_edge_nums()
         if need_comb_features:
+            self.boundary = boundary
             self.edge_prop = self.get_edge_prop()
         self.neigh_areas = self.get_neigh_areas()
-        self.w = self.get_w()
+        self.pos = self.get_pos()
         self.a = self.get_a()
-
-    def get_tex(self):
-        num_reg = len(self.rlist)
-        ml_fiters = self.ml_kernal()
-        gray = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
-        gray = gray.astype(np.float) / 255.0
-        tex = np.zeros([gray.shape[0], gray.shape[1], 15])
-        for i in range(15):
-            tex[:, :, i] = cv2.filter2D(gray, cv2.CV_64F, ml_fiters[:, :, i])
-        for i in range(15):
-            tex_max = np.max(tex[:, :, i])
-            tex_min = np.min(tex[:, :, i])
-            tex[:, :, i] = (tex[:, :, i] - tex_min)/(tex_max - tex_min) * 255
-        tex = tex.astype(np.int32)
-        return tex
-
-    def get_lbp(self):
-        num_reg = len(self.rlist)
-        gray = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
-        lbp = local_binary_pattern(gray, 8, 1.).astype(np.int32)
-        _lbp = np.zeros((lbp.shape[0], lbp.shape[1], 1))
-        _lbp[:, :, 0] = lbp
-        return _lbp
+        self.present, self.present_nums = self.get_present()
 
     def get_coord(self):
-        num_reg = len(self.rlist)
-        coord = np.zeros([num_reg, 7])
+        stats = self.stats
+        coord = np.zeros([stats.num, 7])
         EPS = 1.
-        for i in range(num_reg):
-            sum_y_x = np.sum(np.array(self.rlist[i]), axis=1)
-            num_pix = len(self.rlist[i][0])
-            coord[i][0:2] = sum_y_x // num_pix
-            coord[i][0] /= self.height
-            coord[i][1] /= self.width
-            sortbyy = sorted(self.rlist[i][0])
-            sortbyx = sorted(self.rlist[i][1])
-            tenth = int(num_pix*0.1)
-            ninetith = int(num_pix*0.9)
-            coord[i][2:4] = [sortbyy[tenth] /
-                             self.height, sortbyx[tenth]/self.width]
-            coord[i][4:6] = [sortbyy[ninetith] /
-                             self.height, sortbyx[ninetith]/self.width]
-            a = float(sortbyy[-1] - sortbyy[0])
-            b = float(sortbyx[-1] - sortbyx[0] + EPS)
-            ratio = a/b
-            coord[i][6] = ratio * RATIO_C
+        num_pix = stats.counts
+        coord[:, 0] = stats.sum_y // num_pix / self.height
+        coord[:, 1] = stats.sum_x // num_pix / self.width
+        tenth = (num_pix*0.1).astype(np.int64)
+        ninetith = (num_pix*0.9).astype(np.int64)
+        coord[:, 2] = stats.kth(stats.hist_y, tenth) / self.height
+        coord[:, 3] = stats.kth(stats.hist_x, tenth) / self.width
+        coord[:, 4] = stats.kth(stats.hist_y, ninetith) / self.height
+        coord[:, 5] = stats.kth(stats.hist_x, ninetith) / self.width
+        a = stats.kth(stats.hist_y, num_pix - 1) - stats.kth(stats.hist_y, 0)
+        b = stats.kth(stats.hist_x, num_pix - 1) - \
+            stats.kth(stats.hist_x, 0) + EPS
+        coord[:, 6] = a / b * RATIO_C
         return coord
 
-    def get_avg_var(self, a):
-        num_reg = len(self.rlist)
-        avg = np.zeros([num_reg, a.shape[2]])
-        var = np.zeros([num_reg, a.shape[2]])
-        for i in range(num_reg):
-            num_pix = len(self.rlist[i][0])
-            for j in range(a.shape[2]):
-                avg[i, j] = np.sum(a[:, :, j][self.rlist[i]]) / num_pix
-                var[i, j] = np.sum(
-                    (a[:, :, j][self.rlist[i]] - avg[i, j])**2) / num_pix
+    def get_avg_var(self, name):
+        avg, var = self.stats.avg_var(name)
         var /= 255.**2
         return avg, var
 
-    def get_edges(self, need_comb_features):
-        rmat = self.rmat
-        rlist = self.rlist
-        shape = (rmat.shape[0], rmat.shape[1], 8, )
-        edge_mat = np.zeros(shape, dtype=np.int32)
-        edge_mat[:-1, :, 0] += (rmat[1:, :] - rmat[:-1, :])
-        edge_mat[1:, :, 1] += (rmat[:-1, :] - rmat[1:, :])
-        edge_mat[:, :-1, 2] += (rmat[:, 1:] - rmat[:, :-1])
-        edge_mat[:, 1:, 3] += (rmat[:, :-1] - rmat[:, 1:])
-        edge_mat[:-1, :-1, 4] += (rmat[1:, 1:] - rmat[:-1, :-1])
-        edge_mat[:-1, 1:, 5] += (rmat[1:, :-1] - rmat[:-1, 1:])
-        edge_mat[1:, :-1, 6] += (rmat[:-1, 1:] - rmat[1:, :-1])
-        edge_mat[1:, 1:, 7] += (rmat[:-1, :-1] - rmat[1:, 1:])
-        edge_mat[edge_mat != 0] = 1
-
-        def generate_y_list(y): return [y+1, y-1, y, y, y+1, y+1, y-1, y-1]
-
-        def generate_x_list(x): return [x, x, x+1, x-1, x+1, x-1, x+1, x-1]
-        shape = (rmat.shape[0], rmat.shape[1], 2, 8)
-        y_x = np.zeros(shape, dtype=np.int32)
-        for y in range(shape[0]):
-            for x in range(shape[1]):
-                y_x[y, x, 0, :] = generate_y_list(y)
-                y_x[y, x, 1, :] = generate_x_list(x)
-        edge_nums = []
-        edge_neigh = []
-        edge_point = []
-
-        def append_not_exist(x, _list): return _list.append(
-            x) if x not in _list else _list
-        for region in rlist:
-            num = 0.
-            neighs = []
-            points = []
-            for y, x in zip(region[0], region[1]):
-                for edge_direct in range(edge_mat.shape[2]):
-                    if edge_mat[y, x, edge_direct] != 0:
-                        y_ = y_x[y, x, 0, edge_direct]
-                        x_ = y_x[y, x, 1, edge_direct]
-                        num += 1.
-                        neigh_id = rmat[y_, x_]
-                        if neigh_id not in neighs:
-                            neighs.append(neigh_id)
-                        p = {"neigh_id": neigh_id, "point": (y_, x_,)}
-                        points.append(p)
-            edge_nums.append(num)
-            if need_comb_features:
-                assert(len(neighs) != 0)
-                edge_neigh.append(neighs)
-                _points = [[(), ()] for i in range(len(neighs))]
-                for p in points:
-                    index = neighs.index(p["neigh_id"])
-                    _points[index][0] += (p["point"][0],)
-                    _points[index][1] += (p["point"][1],)
-                edge_point.append(_points)
-        max_edge_num = max(edge_nums)
-        edge_nums = [edge/max_edge_num for edge in edge_nums]
-        return edge_nums, edge_neigh, edge_point
+    def get_edge_nums(self):
+        edge_nums = self.stats.edge_nums()
+        return edge_nums / np.max(edge_nums)
 
     def get_edge_prop(self):
-        num_reg = len(self.rlist)
-        edge_prop = np.zeros((num_reg, num_reg, 7))
-        for i in range(num_reg):  # region i
-            for k in range(len(self.edge_neigh[i])):
-                j = self.edge_neigh[i][k]  # region j
-                # the points in the edge between Ri and Rj
-                edge_ij = self.edge_point[i][k]
-                num_points = len(edge_ij[0])
-                edge_prop[i, j, 0] = float(
-                    sum(edge_ij[0]) / (num_points * self.height))
-                edge_prop[i, j, 1] = float(
-                    sum(edge_ij[1]) / (num_points * self.width))
-                sortby_y = sorted(edge_ij[0])
-                sortby_x = sorted(edge_ij[1])
-                tenth = int(num_points * 0.1)
-                ninetith = int(num_points * 0.9)
-                edge_prop[i, j, 2] = float(sortby_y[tenth]/self.height)
-                edge_prop[i, j, 3] = float(sortby_x[tenth]/self.width)
-                edge_prop[i, j, 4] = float(sortby_y[ninetith]/self.height)
-                edge_prop[i, j, 5] = float(sortby_x[ninetith]/self.width)
-                edge_prop[i, j, 6] = EDGE_NEIGH * float(
-                    num_points / (self.width * self.height))
+        """
+        Properties of the edge of every adjacent pair (i, j), from the pixels of
+        region j next to region i.
+        return:
+            - edge_prop: np( [num of adjacent pairs, 7] ), in the order of
+                         boundary.adj_i / boundary.adj_j
+        """
+        boundary = self.boundary
+        # every region has a neighbour
+        assert(np.all(np.diff(boundary.adj_offsets) != 0))
+        num_pair = len(boundary.adj_i)
+        num_points = np.diff(boundary.pair_offsets)
+        pair = np.repeat(np.arange(num_pair), num_points)
+        edge_prop = np.zeros((num_pair, 7))
+        edge_prop[:, 0] = np.bincount(
+            pair, weights=boundary.y, minlength=num_pair) / (num_points * self.height)
+        edge_prop[:, 1] = np.bincount(
+            pair, weights=boundary.x, minlength=num_pair) / (num_points * self.width)
+        sortby_y = boundary.y[np.lexsort((boundary.y, pair))]
+        sortby_x = boundary.x[np.lexsort((boundary.x, pair))]
+        tenth = boundary.pair_offsets[:-1] + (num_points * 0.1).astype(np.int64)
+        ninetith = boundary.pair_offsets[:-1] + \
+            (num_points * 0.9).astype(np.int64)
+        edge_prop[:, 2] = sortby_y[tenth] / self.height
+        edge_prop[:, 3] = sortby_x[tenth] / self.width
+        edge_prop[:, 4] = sortby_y[ninetith] / self.height
+        edge_prop[:, 5] = sortby_x[ninetith] / self.width
+        edge_prop[:, 6] = EDGE_NEIGH * num_points / (self.width * self.height)
         return edge_prop
 
     def get_neigh_areas(self):
-        num_reg = len(self.rlist)
-        diff = np.zeros([num_reg, num_reg])
         sigmadist = 0.4
-        for i in range(num_reg):
-            diff[i] = np.sum(
-                (self.coord[i, 0:2] - self.coord[:, 0:2])**2, axis=1)
+        diff = Utils.get_dist(self.coord[:, 0:2])
         diff = np.exp(-1*diff/sigmadist)
-        for j in range(diff.shape[1]):
-            diff[:, j] *= len(self.rlist[j][0])
+        diff *= self.stats.counts
         neigh_areas = np.sum(diff, axis=0)
         neigh_areas /= self.width * self.height
         neigh_areas *= NEIGH_AREAS_C
         return neigh_areas
 
-    def get_w(self):
-        num_reg = len(self.rlist)
-        pos = np.zeros([num_reg, 2])
-        for i in range(num_reg):
-            reg_array = np.array(self.rlist[i])
-
-            pos[i, :] = np.sum(reg_array, axis=1) / reg_array.shape[1]
-        pos[:, 0] /= self.height
-        pos[:, 1] /= self.width
-        diff = np.zeros([num_reg, num_reg])
-        for i in range(num_reg):
-            diff[i] = np.sum((pos[i, 0:2] - pos[:, 0:2])**2, axis=1)
-        w = np.exp(-1. * diff / 2)
-        return w
+    def get_pos(self):
+        pos = np.zeros([self.stats.num, 2])
+        pos[:, 0] = self.stats.sum_y / self.stats.counts / self.height
+        pos[:, 1] = self.stats.sum_x / self.stats.counts / self.width
+        return pos
 
     def get_a(self):
-        a = np.zeros([len(self.rlist), 1])
-        a[:, 0] = [float(len(r[0]))/float(self.width*self.height)
-                   for r in self.rlist]
-        a = np.array(a)*A_C
+        a = np.zeros([self.stats.num, 1])
+        a[:, 0] = self.stats.counts / float(self.width*self.height)
+        a = a*A_C
         return a
 
-    @staticmethod
-    def get_background(height, width):
-        blist = [(), ()]
-        y = [y_ for y_ in range(15)] + \
-            [y_ for y_ in range(height-15, height)]
-        x = [x_ for x_ in range(width)]
-        for y_ in y:
-            for x_ in x:
-                blist[0] += (y_,)
-                blist[1] += (x_,)
-        y = [y_ for y_ in range(15, height - 15)]
-        x = [x_ for x_ in range(15)] + \
-            [x_ for x_ in range(width-15, width)]
-        for y_ in y:
-            for x_ in x:
-                blist[0] += (y_,)
-                blist[1] += (x_,)
-        return tuple(blist)
-
-    def ml_kernal(self):
-        ml_filters = makeLMfilters()
-        ml_filters = ml_filters[:, :, 0:15]
-        return ml_filters
-
-    def get_diff(self, array):
-        num_reg = array.shape[0]
-        mat = np.zeros([num_reg, num_reg])
-        for i in range(num_reg):
-            mat[i] = np.abs(array[i] - array[:])
-        return mat
+    def get_present(self):
+        """
+        0/1 presence of the values of every histogram, and their sums.
+        """
+        present, nums = {}, {}
+        for name, hist in self.stats.hists.items():
+            present[name] = (hist > 0).astype(HIST_DTYPE)
+            nums[name] = np.sum(present[name], axis=1)
+        return present, nums
 
-    def get_diff_hist(self, color):
-        num_reg = len(self.rlist)
-        hist = np.ones([num_reg, 256])
-        for i in range(num_reg):
-            hist[i][color[self.rlist[i]]] += 1
-        mat = np.zeros([num_reg, num_reg])
-        for i in range(num_reg):
-            a = 2 * (hist[i] - hist[:])**2
-            b = hist[i] + hist[:] + 1
-            mat[i] = np.sum(a/b, axis=1)
-        return mat
+    @staticmethod
+    def get_dist(pos, other=None):
+        """
+        Squared distances between every row of pos and every row of other,
+        default is pos.
+        """
+        other = pos if other is None else other
+        diff = np.zeros([pos.shape[0], other.shape[0]])
+        for j in range(pos.shape[1]):
+            diff += (pos[:, j:j+1] - other[:, j])**2
+        return diff
 
-    def dot(self, x, hist=False):
-        if hist:
-            diff = self.get_diff_hist(x)
-        else:
-            diff = self.get_diff(x)
-        x = self.w * diff
-        x = x * self.a[0]
-        return x
+    @staticmethod
+    def get_background(height, width):
+        """
+        The 15 pixels wide border of the img, as (ys, xs).
+        """
+        mask = np.zeros([height, width], dtype=bool)
+        mask[:15] = mask[height-15:] = True
+        blist = np.nonzero(mask)
+        mask[:] = False
+        mask[15:height-15, :15] = mask[15:height-15, width-15:] = True
+        _blist = np.nonzero(mask)
+        return (np.concatenate([blist[0], _blist[0]]),
+                np.concatenate([blist[1], _blist[1]]))
+
+    def stack_contrast(self, w, diff, diff_hist):
+        """
+        The 29 contrast features: 9 color averages, the rgb, hsv and lab
+        histograms, 15 texture averages, the texture and lbp histograms, every
+        one weighted by the spatial closeness w.
+        args:
+            - diff: diff(x) is the difference of the values x of the regions.
+            - diff_hist: diff_hist(name) is the distance of the histograms.
+        """
+        features = np.zeros((29,) + w.shape)
+        for i in range(9):
+            features[i] = diff(self.color_avg[:, i])
+        features[9] = diff_hist("rgb")
+        features[10] = diff_hist("hsv")
+        features[11] = diff_hist("lab")
+        for i in range(15):
+            features[i+12] = diff(self.tex_avg[:, i])
+        features[27] = diff_hist("tex")
+        features[28] = diff_hist("lbp")
+        features *= w
+        features *= self.a[0]
+        return features
+
+    def get_contrast(self, rows):
+        """
+        Contrast of the regions in rows against every region.
+        args:
+            - rows: slice of the region ids.
+        return:
+            - np( [29, len(rows), num of regions] )
+        """
+        w = np.exp(-1. * Utils.get_dist(self.pos[rows], self.pos) / 2)
+        present, nums = self.present, self.present_nums
+        return self.stack_contrast(
+            w, lambda x: np.abs(x[rows, None] - x),
+            lambda name: presence_chi(present[name][rows], present[name],
+                                      nums[name][rows], nums[name]))
+
+    def get_pair_contrast(self, i, j):
+        """
+        Contrast of the pairs of regions (i[k], j[k]) only.
+        return:
+            - np( [29, len(i)] )
+        """
+        w = np.exp(-1. * np.sum((self.pos[i] - self.pos[j])**2, axis=1) / 2)
+        present, nums = self.present, self.present_nums
+        return self.stack_contrast(
+            w, lambda x: np.abs(x[i] - x[j]),
+            lambda name: pair_presence_chi(present[name][i], present[name][j],
+                                           nums[name][i], nums[name][j]))
+
+    def get_contrast_sums(self):
+        """
+        Sums of the contrast of every region against all regions, computed
+        block by block so the [29, num, num] features are never held at once.
+        return:
+            - np( [29, num of regions] )
+        """
+        num = self.stats.num
+        sums = np.zeros([29, num])
+        # a block holds the features and about as much temporaries
+        for rows in row_blocks(num, 2 * 29 * num * 8):
+            sums[:, rows] = np.sum(self.get_contrast(rows), axis=2)
+        return sums
@@ -1,2 +1,7 @@
 from .random_forest import RandomForest
-from .multilayer_perceptron import MLP
\ No newline at end of file
+from .multilayer_perceptron import MLP
+from .flat_forest import FlatForest
+from .flat_mlp import FlatMLP
+from .feature_store import FeatureStore
+from .data_cache import DataCache
+from .fusion_trainer import FusionTrainer
\ No newline at end of file
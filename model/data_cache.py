@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+
+import numpy as np
+
+CACHE_DIR = "data/cache"
+# disk budget of the cache, the least recently used entries are evicted
+CACHE_BYTES = 8 * 2**30
+# once over budget, entries are evicted down to this fraction of it, so the
+# next puts do not evict again
+CACHE_LOW = 0.8
+# change it when the layout of the cached arrays changes
+CACHE_VERSION = 1
+
+# {cache dir: bytes of its entries}, the running totals of this process
+_totals = {}
+
+
+def file_hash(path, chunk_bytes=2**20):
+    """
+    sha1 of the content of a file.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_bytes), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class DataCache():
+    """Cache of what is loaded or computed from source content.
+
+    An entry is keyed on the sha1 of the source content and the parameters,
+    so a changed source or other parameters never hit a stale entry. Every
+    entry is a directory of .npy arrays, read back as memory maps, or of one
+    pickled value (like the artifacts of the stages of pipeline.py). Hits
+    refresh the entry's mtime, and entries are evicted by oldest mtime once
+    the cache is over its disk budget.
+
+    The size of the cache is scanned once by every process, then kept as a
+    running total of its puts, so a put does not list the entries. The puts
+    of other processes are only counted at the next scan, by eviction, so
+    with several processes the cache can go over budget by what they put
+    meanwhile.
+
+    Attributes:
+        cache_dir: the directory of the entries.
+        budget: disk budget in bytes.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, budget=CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.budget = budget
+
+    def key(self, path, **params):
+        return DataCache.key_of(source=file_hash(path), **params)
+
+    @staticmethod
+    def key_of(**params):
+        """
+        The key of json params, like the key of the entry a value is computed
+        from and the parameters of the computation.
+        """
+        params = dict(params, version=CACHE_VERSION)
+        text = json.dumps(params, sort_keys=True).encode("utf-8")
+        return hashlib.sha1(text).hexdigest()
+
+    def get(self, key):
+        """
+        return:
+            - {name: np}, the arrays put with key as read only memory maps,
+              or None
+        """
+        entry = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(entry, "names.json"), "r") as file:
+                names = json.load(file)
+            arrays = {name: np.load(os.path.join(entry, name + ".npy"),
+                                    mmap_mode="r") for name in names}
+            os.utime(entry)
+        except OSError:
+            # not cached, or evicted by another process meanwhile
+            return None
+        return arrays
+
+    def put(self, key, arrays):
+        """
+        args:
+            - arrays: {name: np}
+        """
+        def write(temp):
+            for name, array in arrays.items():
+                np.save(os.path.join(temp, name + ".npy"), array)
+            with open(os.path.join(temp, "names.json"), "w+") as file:
+                json.dump(list(arrays), file)
+        self._put(key, write)
+
+    def get_value(self, key):
+        """
+        return:
+            - the value put with put_value at key, or None
+        """
+        entry = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(entry, "value.pkl"), "rb+") as file:
+                value = pickle.load(file)
+            os.utime(entry)
+        except OSError:
+            return None
+        return value
+
+    def put_value(self, key, value):
+        def write(temp):
+            with open(os.path.join(temp, "value.pkl"), "wb+") as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._put(key, write)
+
+    def cached(self, key, compute):
+        """
+        The value at key, compute() is called and put if it is not cached.
+        """
+        value = self.get_value(key)
+        if value is None:
+            value = compute()
+            self.put_value(key, value)
+        return value
+
+    def _put(self, key, write):
+        entry = os.path.join(self.cache_dir, key)
+        temp = entry + ".tmp{}".format(os.getpid())
+        os.makedirs(temp, exist_ok=True)
+        write(temp)
+        size = DataCache.entry_size(temp)
+        try:
+            os.rename(temp, entry)
+        except OSError:
+            # put by another process meanwhile
+            shutil.rmtree(temp, ignore_errors=True)
+            return
+        cache_dir = os.path.abspath(self.cache_dir)
+        if cache_dir not in _totals:
+            _totals[cache_dir] = sum(size for _, _, size in self.entries())
+        else:
+            _totals[cache_dir] += size
+        if _totals[cache_dir] > self.budget:
+            self.evict(keep=key)
+
+    @staticmethod
+    def entry_size(entry):
+        return sum(os.path.getsize(os.path.join(entry, name))
+                   for name in os.listdir(entry))
+
+    def entries(self):
+        """
+        return:
+            - [(mtime, key, bytes) of every entry]
+        """
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, key)
+            if ".tmp" in key:
+                continue
+            try:
+                if not os.path.isdir(entry):
+                    continue
+                entries.append((os.path.getmtime(entry), key,
+                                DataCache.entry_size(entry)))
+            except OSError:
+                # evicted by another process meanwhile
+                continue
+        return entries
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the cache is within
+        CACHE_LOW of its budget, the entry keep stays.
+        """
+        entries = self.entries()
+        total = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total <= CACHE_LOW * self.budget:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total -= size
+        _totals[os.path.abspath(self.cache_dir)] = total
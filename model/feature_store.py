@@ -0,0 +1,146 @@
+import json
+import os
+
+import numpy as np
+
+MANIFEST = "manifest.json"
+
+
+class FeatureStore():
+    """Append-only store of feature rows, .npy shards plus a manifest.
+
+    Every append writes one shard (like the rows of one img) and then the
+    manifest, which lists the shards in order, so a store read while it is
+    written only sees whole shards. Shards are read as memory maps, no text
+    is formatted or parsed. Rows are laid out like the csvs of Region2Csv:
+        | label | features |
+    The labels of every shard are also saved on their own, so they are read
+    without the features.
+
+    Attributes:
+        path: the directory of the store.
+        width: columns of every row.
+        shards: [{"file": name of the .npy, "label": name of the .npy of its
+                  labels, "rows": num of rows}], stores written before the
+                label files have no "label".
+    """
+
+    def __init__(self, path, width=None, reset=False):
+        """
+        args:
+            - width: columns of every row, needed to create a store.
+            - reset: drop the rows already in the store.
+        """
+        self.path = path
+        manifest_path = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest_path) and not reset:
+            with open(manifest_path, "r") as file:
+                manifest = json.load(file)
+            self.width = manifest["width"]
+            self.shards = manifest["shards"]
+            if width is not None and width != self.width:
+                raise ValueError("{} has {} columns, not {}".format(
+                    path, self.width, width))
+            return
+        if width is None:
+            raise IOError("{} is not a feature store".format(path))
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(manifest_path):
+            for shard in FeatureStore(path).shards:
+                os.remove(os.path.join(path, shard["file"]))
+                if "label" in shard:
+                    os.remove(os.path.join(path, shard["label"]))
+        self.width = width
+        self.shards = []
+        self.save_manifest()
+
+    @staticmethod
+    def is_store(path):
+        return os.path.exists(os.path.join(path, MANIFEST))
+
+    def save_manifest(self):
+        manifest_path = os.path.join(self.path, MANIFEST)
+        with open(manifest_path + ".tmp", "w+") as file:
+            json.dump({"width": self.width, "shards": self.shards}, file)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def append(self, data):
+        """
+        args:
+            - data: np( [num of rows, width] )
+        """
+        data = np.asarray(data, dtype=np.float64)
+        if data.ndim != 2 or data.shape[1] != self.width:
+            raise ValueError("rows of {} have {} columns".format(
+                self.path, self.width))
+        if len(data) == 0:
+            return
+        name = "{:06d}.npy".format(len(self.shards))
+        label = "{:06d}.label.npy".format(len(self.shards))
+        np.save(os.path.join(self.path, name), data)
+        np.save(os.path.join(self.path, label), data[:, 0])
+        self.shards.append({"file": name, "label": label, "rows": len(data)})
+        self.save_manifest()
+
+    def __len__(self):
+        return sum(shard["rows"] for shard in self.shards)
+
+    def load(self):
+        """
+        return:
+            - [np( [rows, width] )], the shards as read only memory maps
+        """
+        return [np.load(os.path.join(self.path, shard["file"]), mmap_mode="r")
+                for shard in self.shards]
+
+    def read(self):
+        """
+        All the rows. With more than one shard they are concatenated in
+        memory, use load, column or take to read only a part of them.
+        return:
+            - data: np( [num of rows, width] ), a memory map if there is only
+                    one shard.
+        """
+        shards = self.load()
+        if len(shards) == 0:
+            return np.zeros([0, self.width])
+        if len(shards) == 1:
+            return shards[0]
+        return np.concatenate(shards)
+
+    def column(self, k):
+        """
+        Column 0, the labels, is read from the label files, the other columns
+        page in the rows of every shard.
+        return:
+            - np( [num of rows] ), column k of all the rows, read shard by shard.
+        """
+        if len(self.shards) == 0:
+            return np.zeros(0)
+        columns = []
+        for shard in self.shards:
+            if k == 0 and "label" in shard:
+                columns.append(np.load(os.path.join(self.path, shard["label"])))
+                continue
+            data = np.load(os.path.join(self.path, shard["file"]), mmap_mode="r")
+            columns.append(np.asarray(data[:, k]))
+        return np.concatenate(columns)
+
+    def take(self, index):
+        """
+        Rows of the store, without reading the other rows of the shards.
+        args:
+            - index: np( [num of rows taken] ), row numbers over all the shards,
+                     sorted ones are read in order.
+        return:
+            - data: np( [num of rows taken, width] )
+        """
+        index = np.asarray(index, dtype=np.int64)
+        shards = self.load()
+        starts = np.cumsum([0] + [shard["rows"] for shard in self.shards])
+        shard_of = np.searchsorted(starts, index, side="right") - 1
+        data = np.empty([len(index), self.width])
+        for k in np.unique(shard_of):
+            taken = np.flatnonzero(shard_of == k)
+            data[taken] = shards[k][index[taken] - starts[k]]
+        return data
@@ -0,0 +1,171 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .model_store import load_store, save_store
+
+# rows evaluated together by one thread
+BATCH_ROWS = 2048
+
+
+class FlatForest():
+    """Inference engine of a fitted RandomForestClassifier.
+
+    The nodes of all the trees are packed into flat arrays, a batch is
+    evaluated level by level: every (tree, row) pair steps to a child at once,
+    so the cost is max_depth vectorized steps instead of a call per tree.
+    Leaves point to themselves, pairs which reach a leaf early are dropped
+    from the next steps.
+
+    Attributes:
+        feature, threshold: np( [num of nodes] ), the split of every node,
+                            go left if x[feature] <= threshold.
+        children: np( [num of nodes, 2] ), the left and right child of every node.
+        value: np( [num of nodes, num of classes] ), the class probabilities of
+               every leaf.
+        roots: np( [num of trees] ), the root node of every tree.
+        max_depth: depth of the deepest tree.
+        classes_: the classes, like the sklearn model.
+        is_leaf, threshold32: np( [num of nodes] ), whether every node is a
+                              leaf, and its threshold for float32 rows.
+    """
+
+    def __init__(self, feature, threshold, children, value, roots, max_depth,
+                 classes, n_jobs=-1):
+        """
+        args:
+            - n_jobs: threads used by predict_proba, -1 is all the cpus.
+        """
+        self.feature, self.threshold = feature, threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.classes_ = classes
+        self.n_jobs = n_jobs
+        self.is_leaf = children[:, 0] == np.arange(len(children))
+        # x <= threshold for a float32 x is x <= the largest float32 which is
+        # not above threshold, so the rows are not cast to float64
+        self.threshold32 = threshold.astype(np.float32)
+        over = self.threshold32 > threshold
+        self.threshold32[over] = np.nextafter(self.threshold32[over],
+                                              np.float32(-np.inf))
+
+    @staticmethod
+    def from_sklearn(clf, dtype=np.float64, n_jobs=-1):
+        """
+        args:
+            - clf: a fitted RandomForestClassifier.
+            - dtype: dtype of the leaf values and the sums of the trees,
+                     np.float64 gives the same probabilities as predict_proba.
+        """
+        trees = [e.tree_ for e in clf.estimators_]
+        sizes = [t.node_count for t in trees]
+        roots = np.zeros(len(trees), dtype=np.int64)
+        np.cumsum(sizes[:-1], out=roots[1:])
+        feature, threshold, children, value = [], [], [], []
+        for root, t in zip(roots, trees):
+            nodes = root + np.arange(t.node_count, dtype=np.int64)
+            is_leaf = t.children_left < 0
+            feature.append(np.where(is_leaf, 0, t.feature))
+            threshold.append(np.where(is_leaf, np.inf, t.threshold))
+            children.append(np.stack(
+                [np.where(is_leaf, nodes, root + t.children_left),
+                 np.where(is_leaf, nodes, root + t.children_right)], axis=1))
+            v = t.value[:, 0, :]
+            normalizer = np.sum(v, axis=1, keepdims=True)
+            normalizer[normalizer == 0.0] = 1.0
+            value.append(v / normalizer)
+        return FlatForest(
+            np.concatenate(feature).astype(np.int32),
+            np.concatenate(threshold),
+            np.concatenate(children).astype(np.int32),
+            np.concatenate(value).astype(dtype),
+            roots.astype(np.int32),
+            max(t.max_depth for t in trees), clf.classes_, n_jobs)
+
+    def save(self, model_path):
+        """
+        Save the arrays in a model store, see model_store.save_store.
+        """
+        meta = {"max_depth": int(self.max_depth),
+                "classes": self.classes_.tolist()}
+        arrays = {"feature": self.feature, "threshold": self.threshold,
+                  "children": self.children, "value": self.value,
+                  "roots": self.roots}
+        save_store(model_path, "forest", meta, arrays)
+
+    @staticmethod
+    def load(model_path, n_jobs=-1):
+        """
+        Load a FlatForest.save file, its arrays are memory mapped.
+        """
+        kind, meta, arrays = load_store(model_path)
+        if kind != "forest":
+            raise IOError("{} is not a forest".format(model_path))
+        return FlatForest(arrays["feature"], arrays["threshold"],
+                          arrays["children"], arrays["value"], arrays["roots"],
+                          meta["max_depth"], np.array(meta["classes"]), n_jobs)
+
+    def apply(self, X):
+        """
+        return:
+            - nodes: np( [num of rows, num of trees] ), the leaf every row reaches
+                     in every tree.
+        """
+        num_rows = X.shape[0]
+        # tree by tree, so the nodes of one step are close in memory
+        nodes_at = np.repeat(self.roots, num_rows)
+        rows = np.tile(np.arange(num_rows, dtype=np.int32), len(self.roots))
+        features = np.ascontiguousarray(X.T, dtype=np.float32).reshape(-1)
+        children = self.children.reshape(-1)
+        # only the pairs not at a leaf yet step, the others are dropped once
+        # they are half of the pairs left, so they are not copied every step
+        active = None
+        for _ in range(self.max_depth):
+            x = features[self.feature[nodes_at] * num_rows + rows]
+            nodes_at = children[2 * nodes_at + (x > self.threshold32[nodes_at])]
+            inner = ~self.is_leaf[nodes_at]
+            num_inner = np.count_nonzero(inner)
+            if num_inner == 0:
+                break
+            if 2 * num_inner < len(nodes_at):
+                if active is None:
+                    nodes, active = nodes_at.copy(), np.flatnonzero(inner)
+                else:
+                    nodes[active] = nodes_at
+                    active = active[inner]
+                nodes_at, rows = nodes_at[inner], rows[inner]
+        if active is None:
+            nodes = nodes_at
+        else:
+            nodes[active] = nodes_at
+        return nodes.reshape(len(self.roots), num_rows).T
+
+    def _predict_proba(self, X):
+        nodes = self.apply(X)
+        Y_prob = np.zeros([X.shape[0], self.value.shape[1]],
+                          dtype=self.value.dtype)
+        # in the order of the trees, like sklearn
+        for t in range(nodes.shape[1]):
+            Y_prob += self.value[nodes[:, t]]
+        Y_prob /= nodes.shape[1]
+        return Y_prob
+
+    def predict_proba(self, X):
+        # the trees split float32 features, like sklearn
+        X = np.asarray(X, dtype=np.float32)
+        batches = [X[s:s + BATCH_ROWS] for s in range(0, len(X), BATCH_ROWS)]
+        n_jobs = os.cpu_count() if self.n_jobs == -1 else self.n_jobs
+        if len(batches) <= 1 or n_jobs <= 1:
+            Y_probs = [self._predict_proba(b) for b in batches]
+        else:
+            with ThreadPoolExecutor(min(n_jobs, len(batches))) as pool:
+                Y_probs = list(pool.map(self._predict_proba, batches))
+        if len(Y_probs) == 0:
+            return np.zeros([0, self.value.shape[1]], dtype=self.value.dtype)
+        return np.concatenate(Y_probs)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
@@ -0,0 +1,94 @@
+import numpy as np
+from scipy.special import expit
+
+from .model_store import load_store, save_store
+
+
+def _relu(x):
+    np.maximum(x, 0, out=x)
+
+
+def _tanh(x):
+    np.tanh(x, out=x)
+
+
+def _logistic(x):
+    expit(x, out=x)
+
+
+def _softmax(x):
+    x -= x.max(axis=1)[:, np.newaxis]
+    np.exp(x, out=x)
+    x /= x.sum(axis=1)[:, np.newaxis]
+
+
+ACTIVATIONS = {"identity": lambda x: None, "relu": _relu, "tanh": _tanh,
+               "logistic": _logistic, "softmax": _softmax}
+
+
+class FlatMLP():
+    """Inference of a fitted MLPClassifier from its weights only.
+
+    The forward pass is the one of sklearn, so it gives the same probabilities.
+
+    Attributes:
+        coefs, intercepts: [np] the weights and biases of every layer.
+        activation, out_activation: names of the activations of the hidden
+                                    layers and of the output layer.
+        classes_: the classes, like the sklearn model.
+    """
+
+    def __init__(self, coefs, intercepts, activation, out_activation, classes):
+        self.coefs = coefs
+        self.intercepts = intercepts
+        self.activation = activation
+        self.out_activation = out_activation
+        self.classes_ = classes
+
+    @staticmethod
+    def from_sklearn(clf):
+        return FlatMLP(clf.coefs_, clf.intercepts_, clf.activation,
+                       clf.out_activation_, clf.classes_)
+
+    def predict_proba(self, X):
+        x = np.asarray(X, dtype=self.coefs[0].dtype)
+        for i, (coef, intercept) in enumerate(zip(self.coefs, self.intercepts)):
+            x = x.dot(coef)
+            x += intercept
+            if i != len(self.coefs) - 1:
+                ACTIVATIONS[self.activation](x)
+        ACTIVATIONS[self.out_activation](x)
+        if x.shape[1] == 1:
+            x = x.ravel()
+            return np.vstack([1 - x, x]).T
+        return x
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def save(self, model_path):
+        """
+        Save the weights in a model store, see model_store.save_store.
+        """
+        meta = {"layers": len(self.coefs), "activation": self.activation,
+                "out_activation": self.out_activation,
+                "classes": self.classes_.tolist()}
+        arrays = {}
+        for i, (coef, intercept) in enumerate(zip(self.coefs, self.intercepts)):
+            arrays["coef{}".format(i)] = coef
+            arrays["intercept{}".format(i)] = intercept
+        save_store(model_path, "mlp", meta, arrays)
+
+    @staticmethod
+    def load(model_path):
+        """
+        Load a FlatMLP.save file, its weights are memory mapped.
+        """
+        kind, meta, arrays = load_store(model_path)
+        if kind != "mlp":
+            raise IOError("{} is not a mlp".format(model_path))
+        coefs = [arrays["coef{}".format(i)] for i in range(meta["layers"])]
+        intercepts = [arrays["intercept{}".format(i)]
+                      for i in range(meta["layers"])]
+        return FlatMLP(coefs, intercepts, meta["activation"],
+                       meta["out_activation"], np.array(meta["classes"]))
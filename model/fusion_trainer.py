@@ -0,0 +1,120 @@
+import copy
+
+import numpy as np
+
+from .feature_store import FeatureStore
+from .load_data import FEATURE_INDEX_MIN, LABEL_INDEX, reservoir_index
+
+# rows of every partial_fit call
+BATCH_ROWS = 4096
+# shards (imgs) whose rows are shuffled together
+SHUFFLE_SHARDS = 16
+
+
+def sample_pixels(Y, size, random_state=0):
+    """
+    As many pixels of each class of an img, up to size // 2 and the pixels of
+    the smaller class, like do_rebalance with max_rows, see reservoir_index.
+    args:
+        - Y: np( [num of pixels] ), the ground truth (0 or 1) of every pixel,
+             pixels of other values are left out.
+        - size: max pixels of the img, None is no cap.
+    return:
+        - index: np( [pixels kept] ), sorted.
+    """
+    less = min(np.sum(Y == 0), np.sum(Y == 1))
+    if size is not None:
+        less = min(size // 2, less)
+    return reservoir_index(Y, less, random_state)
+
+
+class FusionTrainer():
+    """Train the fusion MLP out of core, with partial_fit on minibatches.
+
+    The rows are streamed from a FeatureStore, one shard for every img:
+        | ground truth | salience of every level |
+    Some shards are held out. Every epoch goes over the other shards in a
+    shuffled order, shuffling the rows of SHUFFLE_SHARDS shards at a time, and
+    then measures the log loss of the held out shards. Training stops when it
+    did not improve by tol for n_iter_no_change epochs, and the clf of the best
+    epoch is kept, so the MLP is saved and loaded as usual.
+
+    Attributes:
+        mlp: the MLP whose clf is trained.
+        best_loss: held out log loss of the kept clf.
+    """
+
+    def __init__(self, mlp, max_epochs=200, n_iter_no_change=10, tol=1e-4,
+                 val_fraction=0.1, batch_rows=BATCH_ROWS, random_state=0):
+        """
+        args:
+            - val_fraction: fraction of the shards held out.
+        """
+        if max_epochs < 1:
+            raise ValueError("max_epochs must be at least 1")
+        self.mlp = mlp
+        self.max_epochs = max_epochs
+        self.n_iter_no_change = n_iter_no_change
+        self.tol = tol
+        self.val_fraction = val_fraction
+        self.batch_rows = batch_rows
+        self.rng = np.random.RandomState(random_state)
+        self.best_loss = np.inf
+
+    def fit(self, store_path):
+        shards = FeatureStore(store_path).load()
+        order = self.rng.permutation(len(shards))
+        num_val = int(np.ceil(len(shards) * self.val_fraction))
+        if len(shards) > 1:
+            num_val = min(max(num_val, 1), len(shards) - 1)
+        else:
+            num_val = 0
+        val = [shards[k] for k in order[:num_val]]
+        train = [shards[k] for k in order[num_val:]]
+        # the loss of every minibatch would be printed
+        self.mlp.clf.verbose = False
+        best_clf, no_change = None, 0
+        for epoch in range(self.max_epochs):
+            self.fit_epoch(train)
+            loss = self.loss(val if val else train)
+            print("epoch {}, held out loss {:.6f}".format(epoch, loss))
+            if loss < self.best_loss - self.tol:
+                no_change = 0
+            else:
+                no_change += 1
+            if loss < self.best_loss:
+                self.best_loss = loss
+                best_clf = copy.deepcopy(self.mlp.clf)
+            if no_change >= self.n_iter_no_change:
+                break
+        if best_clf is not None:
+            self.mlp.clf = best_clf
+        return self.mlp
+
+    def fit_epoch(self, shards):
+        order = self.rng.permutation(len(shards))
+        for s in range(0, len(order), SHUFFLE_SHARDS):
+            data = np.concatenate(
+                [shards[k] for k in order[s:s + SHUFFLE_SHARDS]])
+            data = data[self.rng.permutation(len(data))]
+            for b in range(0, len(data), self.batch_rows):
+                batch = data[b:b + self.batch_rows]
+                self.mlp.clf.partial_fit(
+                    batch[:, FEATURE_INDEX_MIN:], batch[:, LABEL_INDEX],
+                    classes=np.array([0., 1.]))
+
+    def loss(self, shards):
+        """
+        Log loss of the rows of shards.
+        """
+        eps = np.finfo(np.float64).eps
+        total, rows = 0., 0
+        for shard in shards:
+            for b in range(0, len(shard), self.batch_rows):
+                batch = shard[b:b + self.batch_rows]
+                Y = batch[:, LABEL_INDEX]
+                Y_prob = self.mlp.clf.predict_proba(batch[:, FEATURE_INDEX_MIN:])
+                p = np.clip(Y_prob[:, 1], eps, 1 - eps)
+                total -= np.sum(Y * np.log(p) + (1 - Y) * np.log(1 - p))
+                rows += len(Y)
+        return total / max(rows, 1)
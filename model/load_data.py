@@ -1,28 +1,83 @@
-import os
-import pickle
 import numpy as np
 import pandas as pd
-from sklearn.utils import resample
+
+from .data_cache import DataCache
+from .feature_store import FeatureStore
 
 LABEL_INDEX = 0
 FEATURE_INDEX_MIN = 1
+# rows handled at once by rebalancing
+CHUNK_ROWS = 65536
+
+
+def rebalance_index(Y, random_state=0):
+    """
+    The rows kept by rebalancing: the rows of the larger class are resampled
+    (with replacement) to the size of the smaller class, then come the rows
+    of the smaller class. The same rows as sklearn.utils.resample.
+    return:
+        - index: np( [2 * size of the smaller class] )
+    """
+    pos = np.flatnonzero(Y == 1)
+    neg = np.flatnonzero(Y == 0)
+    more, less = (neg, pos) if len(pos) < len(neg) else (pos, neg)
+    rng = np.random.RandomState(random_state)
+    more = more[rng.randint(0, len(more), size=len(less))]
+    return np.concatenate([more, less])
+
+
+def reservoir_index(Y, size, random_state=0, chunk_rows=CHUNK_ROWS):
+    """
+    Stratified reservoir sampling: up to size rows of each class, uniformly
+    without replacement, in one pass over Y chunk by chunk (Y can be a memory
+    map). Each row gets a random key and the rows with the smallest keys of
+    every class are kept.
+    return:
+        - index: np( [rows kept] ), sorted.
+    """
+    rng = np.random.RandomState(random_state)
+    keys = {0: np.zeros(0), 1: np.zeros(0)}
+    rows = {0: np.zeros(0, dtype=np.int64), 1: np.zeros(0, dtype=np.int64)}
+    for s in range(0, len(Y), chunk_rows):
+        y = np.asarray(Y[s:s + chunk_rows])
+        key = rng.random_sample(len(y))
+        for c in (0, 1):
+            in_c = np.flatnonzero(y == c)
+            k = np.concatenate([keys[c], key[in_c]])
+            r = np.concatenate([rows[c], s + in_c])
+            if len(k) > size:
+                keep = np.argpartition(k, size)[:size]
+                k, r = k[keep], r[keep]
+            keys[c], rows[c] = k, r
+    return np.sort(np.concatenate([rows[0], rows[1]]))
+
+
+def take_rows(X, index, chunk_rows=CHUNK_ROWS):
+    """
+    X[index] filled chunk by chunk, so a memory mapped X is only read at the
+    rows needed and no temporaries other than the result are made.
+    """
+    out = np.empty((len(index),) + X.shape[1:], dtype=X.dtype)
+    for s in range(0, len(index), chunk_rows):
+        out[s:s + chunk_rows] = X[index[s:s + chunk_rows]]
+    return out
 
 
-def do_rebalance(X, Y):
-    pos_num = np.sum(Y)
-    neg_num = len(Y) - pos_num
-    X_more = X[Y == 1]
-    X_less = X[Y == 0]
-    Y_more = np.ones(int(pos_num))
-    Y_less = np.zeros(int(neg_num))
-    if pos_num < neg_num:
-        X_more, X_less = X_less, X_more
-        Y_more, Y_less = Y_less, Y_more
-    X_more = resample(X_more, n_samples=len(X_less), random_state=0)
-    Y_more = resample(Y_more, n_samples=len(Y_less), random_state=0)
-    X = np.concatenate([X_more, X_less], axis=0)
-    # X = np.concatenate([Y_more, X_more], axis=0)
-    Y = np.concatenate([Y_more, Y_less], axis=0)
+def do_rebalance(X, Y, max_rows=None):
+    """
+    Balance the 0 and 1 labeled rows.
+    args:
+        - max_rows: if it is set, take a stratified reservoir sample of at most
+                    max_rows // 2 rows of each class (without replacement)
+                    instead of resampling the larger class.
+    """
+    if max_rows is None:
+        index = rebalance_index(Y)
+    else:
+        size = min(max_rows // 2, np.sum(Y == 0), np.sum(Y == 1))
+        index = reservoir_index(Y, size)
+    X = take_rows(X, index)
+    Y = np.asarray(Y[index], dtype=np.float64)
     return X, Y
 
 
@@ -41,13 +96,38 @@ def _load_data(csv_path, rebalance=True):
     return X, Y
 
 
-def load_data(csv_path, rebalance=True):
-    path = csv_path + "_new.pkl"
-    if os.path.exists(path):
-        with open(path, "rb+") as file:
-            [X, Y] = pickle.load(file)
+def load_store(store_path, rebalance=True):
+    """
+    The rows of a FeatureStore. Rebalanced rows are gathered from the memory
+    mapped shards by their index, so only the rows kept are read into memory.
+    """
+    store = FeatureStore(store_path)
+    if rebalance:
+        data = store.take(rebalance_index(store.column(LABEL_INDEX)))
     else:
-        X, Y = _load_data(csv_path, rebalance)
-        with open(path, "wb+") as file:
-            pickle.dump([X, Y], file)
+        data = store.read()
+    X = data[:, FEATURE_INDEX_MIN:]
+    Y = np.asarray(data[:, LABEL_INDEX], dtype=np.float64)
     return X, Y
+
+
+def load_data(csv_path, rebalance=True, cache=True):
+    """
+    args:
+        - csv_path: a csv, or the directory of a FeatureStore, which is read
+                    as it is (no cache).
+        - cache: keep what is loaded from a csv in a DataCache, keyed on its
+                 content and rebalance.
+    """
+    if FeatureStore.is_store(csv_path):
+        return load_store(csv_path, rebalance)
+    if not cache:
+        return _load_data(csv_path, rebalance)
+    data_cache = DataCache()
+    key = data_cache.key(csv_path, rebalance=rebalance)
+    arrays = data_cache.get(key)
+    if arrays is None:
+        X, Y = _load_data(csv_path, rebalance)
+        data_cache.put(key, {"X": X, "Y": Y})
+        return X, Y
+    return arrays["X"], arrays["Y"]
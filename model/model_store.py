@@ -0,0 +1,69 @@
+import json
+
+import numpy as np
+
+MAGIC = b"DRFIMDL1"
+# arrays start at multiples of ALIGN bytes
+ALIGN = 64
+
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def is_store(model_path):
+    with open(model_path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def save_store(model_path, kind, meta, arrays):
+    """
+    Save a model as flat arrays in one file which load_store memory maps.
+
+    The file is MAGIC, the size of the header (little endian uint64), the header (json:
+    kind, meta and the dtype, shape and offset of every array) and then the
+    raw arrays, each one aligned to ALIGN bytes. Offsets count from the first
+    aligned byte after the header.
+    args:
+        - kind: the kind of the model, like "forest" or "mlp".
+        - meta: small json values of the model.
+        - arrays: {name: np}
+    """
+    arrays = {k: np.ascontiguousarray(v) for k, v in arrays.items()}
+    specs, offset = {}, 0
+    for k, v in arrays.items():
+        specs[k] = {"dtype": v.dtype.str, "shape": list(v.shape),
+                    "offset": offset}
+        offset = _aligned(offset + v.nbytes)
+    header = json.dumps(
+        {"kind": kind, "meta": meta, "arrays": specs}).encode("utf-8")
+    start = _aligned(len(MAGIC) + 8 + len(header))
+    with open(model_path, "wb+") as file:
+        file.write(MAGIC)
+        file.write(np.array(len(header), dtype="<u8").tobytes())
+        file.write(header)
+        for k, v in arrays.items():
+            file.seek(start + specs[k]["offset"])
+            file.write(v.tobytes())
+        file.truncate(start + offset)
+
+
+def load_store(model_path):
+    """
+    Load a file of save_store. The arrays are read only views of one memory
+    map, so processes loading the same file share its pages.
+    return:
+        - kind, meta, arrays: like save_store
+    """
+    with open(model_path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise IOError("{} is not a model store".format(model_path))
+        size = int(np.frombuffer(file.read(8), dtype="<u8")[0])
+        header = json.loads(file.read(size).decode("utf-8"))
+    start = _aligned(len(MAGIC) + 8 + size)
+    buffer = np.memmap(model_path, dtype=np.uint8, mode="r")
+    arrays = {}
+    for k, s in header["arrays"].items():
+        arrays[k] = np.ndarray(s["shape"], dtype=np.dtype(s["dtype"]),
+                               buffer=buffer, offset=start + s["offset"])
+    return header["kind"], header["meta"], arrays
@@ -3,7 +3,10 @@ import numpy as np
 from sklearn import metrics
 from sklearn.neural_network import MLPClassifier
 
+from .flat_mlp import FlatMLP
+from .fusion_trainer import FusionTrainer
 from .load_data import do_rebalance
+from .model_store import is_store
 
 
 class MLP():
@@ -18,10 +21,22 @@ class MLP():
     def __init__(self):
         self.clf = MLPClassifier(solver='sgd', activation='relu', alpha=1e-4, hidden_layer_sizes=(20,20,), max_iter=10000, verbose=True, learning_rate_init=.1)
 
-    def train(self, X_train, Y_train):
-        X_train, Y_train = do_rebalance(X_train, Y_train)
+    def train(self, X_train, Y_train, max_rows=None):
+        """
+        args:
+            - max_rows: train on a balanced sample of at most max_rows rows,
+                        see do_rebalance.
+        """
+        X_train, Y_train = do_rebalance(X_train, Y_train, max_rows)
         self.clf.fit(X_train, Y_train)
 
+    def train_stream(self, store_path, **kwargs):
+        """
+        Train with partial_fit on minibatches streamed from a FeatureStore,
+        without loading all the rows, see FusionTrainer for kwargs.
+        """
+        FusionTrainer(self, **kwargs).fit(store_path)
+
     def test(self, X_test, Y_test):
         Y_prob = self.clf.predict_proba(X_test)
         auc = metrics.roc_auc_score(Y_test, Y_prob[:, 1])
@@ -31,10 +46,53 @@ class MLP():
         Y_prob = self.clf.predict_proba(X)[:, 1]
         return Y_prob
 
+    def predict_map(self, salience_map, rmats):
+        """
+        Fuse the salience maps of every level into one map.
+
+        The input of a pixel only depends on the regions it is in, so predict
+        once for every combination of regions over the levels and scatter the
+        results back to the pixels.
+        args:
+            - salience_map: np( [num of levels, height, width] )
+            - rmats: the region id of every pixel at every level.
+        return:
+            - Y_prob: np( [height, width] )
+        """
+        num_levels = salience_map.shape[0]
+        comb = np.zeros(salience_map[0].size, dtype=np.int64)
+        for rmat in rmats:
+            rmat = rmat.reshape(-1)
+            _, first, comb = np.unique(
+                comb * (int(rmat.max()) + 1) + rmat,
+                return_index=True, return_inverse=True)
+            comb = comb.reshape(-1)
+        X = salience_map.reshape(num_levels, -1)[:, first].T
+        Y_prob = self.predict(X)[comb]
+        return Y_prob.reshape(salience_map.shape[1:])
+
     def load_model(self, model_path):
+        """
+        Files saved with flat=True load as a FlatMLP, which predicts the same
+        but can not be trained.
+        """
+        if is_store(model_path):
+            self.clf = FlatMLP.load(model_path)
+            return
         with open(model_path, "rb+") as file:
             self.clf = pickle.load(file)
 
-    def save_model(self, model_path):
+    def save_model(self, model_path, flat=False):
+        """
+        args:
+            - flat: save only the weights in a memory mapped model store, see
+                    model_store.
+        """
+        if flat:
+            clf = self.clf
+            if not isinstance(clf, FlatMLP):
+                clf = FlatMLP.from_sklearn(clf)
+            clf.save(model_path)
+            return
         with open(model_path, "wb+") as file:
-            pickle.dump(self.clf, file)
\ No newline at end of file
+            pickle.dump(self.clf, file)
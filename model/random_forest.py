@@ -1,10 +1,18 @@
 import pickle
 import numpy as np
+from joblib import Parallel, delayed
 from sklearn import metrics
 from treeinterpreter import treeinterpreter as ti
 from sklearn.ensemble import RandomForestClassifier
+from sklearn.tree import DecisionTreeClassifier
 
-from .load_data import load_data
+from .feature_store import FeatureStore
+from .flat_forest import FlatForest
+from .load_data import FEATURE_INDEX_MIN, LABEL_INDEX, load_data, rebalance_index
+from .model_store import is_store
+
+# seeds of the trees are drawn below it, like sklearn
+MAX_INT = np.iinfo(np.int32).max
 
 
 class RandomForest():
@@ -13,17 +21,95 @@ class RandomForest():
     Useing scikit-learn to genearate RF Model.
 
     Attributes:
-        clf: RandomForest Classifier.
+        clf: RandomForest Classifier, or its FlatForest after load_model(flat=True).
     """
 
-    def __init__(self):
+    def __init__(self, n_jobs=-1):
+        """
+        args:
+            - n_jobs: cores fitting (and predicting) the trees, -1 is all the
+                      cpus. The trees do not depend on it.
+        """
         self.clf = RandomForestClassifier(
-            n_estimators=200, max_depth=20, random_state=0, max_features="log2")
+            n_estimators=200, max_depth=20, random_state=0, max_features="log2",
+            n_jobs=n_jobs)
 
     def train(self, train_csv_path):
         X_train, Y_train = load_data(train_csv_path)
         self.clf.fit(X_train, Y_train)
 
+    def grow(self, train_csv_path, n_estimators):
+        """
+        Add n_estimators trees fitted on all the rows of train_csv_path (like
+        a feature store which new imgs were appended to) with warm_start, the
+        trees already fitted are kept.
+        """
+        X_train, Y_train = load_data(train_csv_path)
+        self.clf.set_params(
+            warm_start=True,
+            n_estimators=len(self.clf.estimators_) + n_estimators)
+        self.clf.fit(X_train, Y_train)
+
+    def train_out_of_core(self, store_path, n_estimators=None, max_samples=None):
+        """
+        Fit the trees on a FeatureStore without loading it: every tree draws a
+        bootstrap of the rebalanced rows and reads only those rows from the
+        memory mapped shards, a row drawn many times is read once and weighted
+        by its count. Trees already fitted are kept, like grow.
+        args:
+            - n_estimators: trees added, default the n_estimators of the clf.
+            - max_samples: rows drawn for every tree, default all the
+                           rebalanced rows, it bounds the memory of a tree.
+        """
+        store = FeatureStore(store_path)
+        Y = store.column(LABEL_INDEX)
+        index = rebalance_index(Y)
+        classes, first = np.unique(Y[index], return_index=True)
+        if hasattr(self.clf, "estimators_") and not np.array_equal(
+                classes, self.clf.classes_):
+            raise ValueError("{} has the classes {}, not {}".format(
+                store_path, classes, self.clf.classes_))
+        num_samples = len(index)
+        if max_samples is not None:
+            num_samples = min(num_samples, max_samples)
+        if n_estimators is None:
+            n_estimators = self.clf.n_estimators
+        fitted = getattr(self.clf, "estimators_", [])
+        seeds = np.random.RandomState(self.clf.random_state).randint(
+            MAX_INT, size=len(fitted) + n_estimators)[len(fitted):]
+        params = {p: getattr(self.clf, p) for p in self.clf.estimator_params}
+
+        def fit_tree(seed):
+            drawn = np.random.RandomState(seed).randint(
+                0, len(index), num_samples)
+            rows, counts = np.unique(index[drawn], return_counts=True)
+            # a row of every class the bootstrap missed, at weight 0, so the
+            # tree has all the classes like the trees of sklearn
+            missing = np.flatnonzero(~np.isin(classes, Y[rows]))
+            rows = np.concatenate([rows, index[first[missing]]])
+            counts = np.concatenate([counts, np.zeros(len(missing))])
+            data = store.take(rows)
+            tree = DecisionTreeClassifier(**dict(params, random_state=seed))
+            tree.fit(data[:, FEATURE_INDEX_MIN:], data[:, LABEL_INDEX],
+                     sample_weight=counts.astype(np.float64))
+            if not np.array_equal(tree.classes_, classes):
+                raise ValueError("a tree has the classes {}, not {}".format(
+                    tree.classes_, classes))
+            return tree
+
+        # the trees release the GIL while they are fitted
+        trees = Parallel(n_jobs=self.clf.n_jobs, prefer="threads")(
+            delayed(fit_tree)(seed) for seed in seeds)
+        # what RandomForestClassifier.fit sets, so the clf predicts, pickles and
+        # works with FlatForest and get_weights as usual
+        self.clf.estimators_ = list(fitted) + trees
+        self.clf.n_estimators = len(self.clf.estimators_)
+        self.clf.estimator_ = DecisionTreeClassifier(**params)
+        self.clf.classes_ = classes
+        self.clf.n_classes_ = len(classes)
+        self.clf.n_outputs_ = 1
+        self.clf.n_features_in_ = store.width - FEATURE_INDEX_MIN
+
     def test(self, test_csv_path):
         X_test, Y_test = load_data(test_csv_path, rebalance=False)
         Y_prob = self.clf.predict_proba(X_test)
@@ -38,10 +124,37 @@ class RandomForest():
         prediction, bias, contributions = ti.predict(self.clf, X)
         return prediction, bias, contributions
 
-    def load_model(self, model_path):
+    def load_model(self, model_path, flat=False):
+        """
+        args:
+            - flat: predict with a FlatForest of the model, it gives the same
+                    probabilities with less overhead for every call, but can
+                    not be trained or used by get_weights. Files saved with
+                    flat=True always load as a FlatForest.
+        return:
+            - clf: the loaded model
+        """
+        if is_store(model_path):
+            self.clf = FlatForest.load(model_path)
+            return self.clf
         with open(model_path, "rb+") as file:
             self.clf = pickle.load(file)
+        if flat:
+            self.clf = FlatForest.from_sklearn(self.clf)
+        return self.clf
 
-    def save_model(self, model_path):
+    def save_model(self, model_path, flat=False):
+        """
+        args:
+            - flat: save the FlatForest of the model in a memory mapped model
+                    store, see model_store, which loads almost at once and is
+                    shared by the processes loading it.
+        """
+        if flat:
+            clf = self.clf
+            if not isinstance(clf, FlatForest):
+                clf = FlatForest.from_sklearn(clf)
+            clf.save(model_path)
+            return
         with open(model_path, "wb+") as file:
             pickle.dump(self.clf, file)
@@ -0,0 +1,278 @@
+import os
+from functools import lru_cache
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+from scipy.sparse import coo_matrix
+from threadpoolctl import threadpool_limits
+
+from model import RandomForest, MLP, FeatureStore
+from model.data_cache import DataCache, file_hash
+from feature_process import Features
+from region_detect import Img_Context, Super_Region, Region2Csv
+
+# threshold of the base segmentation
+SEG_C = 100.
+C_LIST = [20, 80, 350, 900]
+# processes the imgs are fanned out to
+WORKERS = os.cpu_count()
+# change it when what a stage computes changes, every artifact is recomputed
+STAGE_VERSION = 3
+
+
+def stage_key(stage, source, **params):
+    """
+    The DataCache key of the artifact of a stage. It is the sha1 of the stage,
+    the key of what it is computed from (like the sha1 of the img, or the key
+    of the artifact of the stage before) and the parameters of the stage (like
+    c or the sha1 of a model). So the artifacts of an img chain up:
+        segment -> features -> similar -> levels -> salience
+    and a changed img, parameter or model only misses the stages after it,
+    while a run that stopped resumes from what was already put.
+    """
+    return DataCache.key_of(stage=stage, source=source,
+                            stage_version=STAGE_VERSION, **params)
+
+
+@lru_cache(maxsize=None)
+def _model_hash(model_path, mtime, size):
+    return file_hash(model_path)
+
+
+def model_hash(model_path):
+    """
+    sha1 of a model file, hashed once by every process until it changes.
+    """
+    stat = os.stat(model_path)
+    return _model_hash(model_path, stat.st_mtime_ns, stat.st_size)
+
+
+class Img_Data:
+    """The artifacts of the stages of an img, see stage_key.
+
+    Only the regions, their statistics and features are kept, not the img or
+    its pixel features. The img is only decoded if its base segmentation or
+    features are not cached.
+
+    Attributes:
+        regions: the Regions of the base segmentation.
+        stats: the RegionStats of regions, the levels are merged from it.
+        comb_i, comb_j, comb_features: the 222-dim features of every adjacent
+                                       pair of regions, see Features.
+        multi_regions: the Regions of every level, the base one first.
+        feature93s: the 93-dim features of every level.
+        keys: {stage: key of the artifact of the img}
+    """
+
+    def __init__(self, img_path, cache=None):
+        """
+        args:
+            - cache: the DataCache of the artifacts, default the one at
+                     data_cache.CACHE_DIR, so they share its budget.
+        """
+        self.img_path = img_path
+        self.cache = DataCache() if cache is None else cache
+        self.img = None
+        self.keys = {}
+        self.regions = self.cached(
+            "segment", file_hash(img_path), self.segment, c=SEG_C)
+        features = self.cached("features", self.keys["segment"], self.features)
+        self.img = None
+        self.stats = features["stats"]
+        self.comb_i, self.comb_j = features["comb_i"], features["comb_j"]
+        self.comb_features = features["comb_features"]
+        self.multi_regions = [self.regions]
+        self.feature93s = [features["features93"]]
+
+    def cached(self, stage, source, compute, **params):
+        self.keys[stage] = stage_key(stage, source, **params)
+        return self.cache.cached(self.keys[stage], compute)
+
+    def get_img(self):
+        if self.img is None:
+            self.img = Img_Context.from_path(self.img_path)
+        return self.img
+
+    def segment(self):
+        return Super_Region.get_region(self.get_img(), SEG_C)
+
+    def features(self):
+        features = Features(self.get_img(), self.regions)
+        return {"stats": features.stats, "features93": features.features93,
+                "comb_i": features.comb_i, "comb_j": features.comb_j,
+                "comb_features": features.comb_features}
+
+    def get_diff_prob(self, rf_path):
+        """
+        return:
+            - diff_prob: np( [num of adjacent pairs] ), the probability of the
+                         rf at rf_path that the regions of every pair are not
+                         one region (label 0). It is the weight of their edge,
+                         the lower it is the sooner they are combined.
+        """
+        return self.cached(
+            "similar", self.keys["features"],
+            lambda: load_rf(rf_path).predict(self.comb_features)[:, 0],
+            model=model_hash(rf_path))
+
+    def get_multi_segs(self, rf_path):
+        """
+        Combine the regions into the levels of C_LIST with the dissimilarity
+        the rf at rf_path gives to every adjacent pair, see get_diff_prob.
+        """
+        diff_prob = self.get_diff_prob(rf_path)
+        multi_regions, feature93s = self.cached(
+            "levels", self.keys["similar"],
+            lambda: self.combine(diff_prob), c_list=C_LIST)
+        self.multi_regions = [self.regions] + multi_regions
+        self.feature93s = self.feature93s[:1] + feature93s
+
+    def combine(self, diff_prob):
+        num_reg = len(self.regions)
+        # only adjacent regions can be combined
+        similarity = coo_matrix(
+            (diff_prob, (self.comb_i, self.comb_j)),
+            shape=(num_reg, num_reg))
+        multi_regions, feature93s = [], []
+        for regions in Super_Region.combine_regions(
+                similarity, C_LIST, self.regions):
+            if len(regions) == 1:
+                continue
+            multi_regions.append(regions)
+            # like Features.combine, from the statistics of the base regions
+            stats = self.stats.merge(regions.trans_array, len(regions))
+            features = Features(None, regions, need_comb_features=False,
+                                stats=stats)
+            feature93s.append(features.features93)
+        return multi_regions, feature93s
+
+    def get_salience_map(self, rf_path, flat=True):
+        """
+        Call it after get_multi_segs.
+        args:
+            - flat: predict with the FlatForest of the rf, else with the
+                    sklearn rf which load_rf(rf_path, flat=False) also gives,
+                    so a worker using it for get_weights loads it once.
+        return:
+            - salience_map: np( [num of levels, height, width] ), the salience
+                            the rf at rf_path gives to the region of every
+                            pixel at each level.
+        """
+        return self.cached(
+            "salience", self.keys["levels"],
+            lambda: self.salience_map(load_rf(rf_path, flat)),
+            model=model_hash(rf_path))
+
+    def salience_map(self, rf):
+        salience_map = [rf.predict(features93)[:, 1][regions.rmat]
+                        for regions, features93 in zip(self.multi_regions,
+                                                       self.feature93s)]
+        return np.stack(salience_map)
+
+
+@lru_cache(maxsize=None)
+def _load_rf(model_path, flat):
+    rf = RandomForest(n_jobs=1)
+    rf.load_model(model_path, flat)
+    rf.clf.n_jobs = 1
+    return rf
+
+
+def load_rf(model_path, flat=True):
+    """
+    A RandomForest loaded once by every worker, predicting on one core.
+    """
+    return _load_rf(model_path, flat)
+
+
+@lru_cache(maxsize=None)
+def load_mlp(model_path):
+    mlp = MLP()
+    mlp.load_model(model_path)
+    return mlp
+
+
+def extract(img_path, seg_path):
+    """
+    Segment an img and compute its features.
+    return:
+        - data: its rows of the similar store, see Region2Csv.get_similar_data
+    """
+    im_data = Img_Data(img_path)
+    return Region2Csv.get_similar_data(
+        im_data.regions, im_data.comb_i, im_data.comb_j,
+        im_data.comb_features, seg_path)
+
+
+def multi_seg(rf_path, img_path, seg_path):
+    """
+    Combine the regions of an img into the levels of C_LIST with the rf at
+    rf_path.
+    return:
+        - data: its rows of the seg store, see Region2Csv.get_seg_data
+    """
+    im_data = Img_Data(img_path)
+    im_data.get_multi_segs(rf_path)
+    return np.concatenate([
+        Region2Csv.get_seg_data(regions, features93, seg_path)
+        for regions, features93 in zip(im_data.multi_regions,
+                                       im_data.feature93s)])
+
+
+def train_cached(model, store_path, stage, cache=None):
+    """
+    Train a RandomForest or MLP on a FeatureStore, or load the clf trained
+    before on the same rows with the same parameters.
+    args:
+        - stage: the name of the model in the cache.
+    return:
+        - model, with its clf trained.
+    """
+    cache = DataCache() if cache is None else cache
+    store = FeatureStore(store_path)
+    rows = [file_hash(os.path.join(store_path, shard["file"]))
+            for shard in store.shards]
+    params = {k: repr(v) for k, v in model.clf.get_params().items()
+              if k not in ("n_jobs", "verbose")}
+
+    def train():
+        if isinstance(model, MLP):
+            model.train_stream(store_path)
+        else:
+            model.train(store_path)
+        return model.clf
+
+    model.clf = cache.cached(stage_key(stage, rows, **params), train)
+    return model
+
+
+def _init_worker():
+    # the workers already use all the cores
+    cv2.setNumThreads(1)
+    threadpool_limits(1)
+
+
+def _apply(job):
+    stage, args = job
+    return stage(*args)
+
+
+def imap_stage(stage, jobs, workers=WORKERS):
+    """
+    Run a stage over the imgs in a pool of worker processes.
+    args:
+        - stage: a function of the module level, called as stage(*args) for
+                 the args of every job.
+        - jobs: [args of every img]
+    return:
+        - the results of stage for every job, in order and as they are
+          finished, so the caller can write them out without keeping them.
+    """
+    if workers <= 1:
+        for args in jobs:
+            yield stage(*args)
+        return
+    with Pool(workers, initializer=_init_worker) as pool:
+        for result in pool.imap(_apply, [(stage, args) for args in jobs]):
+            yield result
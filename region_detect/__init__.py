@@ -1,2 +1,4 @@
+from .img_context import Img_Context
+from .regions import Regions
 from .super_region import Super_Region
 from .generate_csv import Region2Csv
\ No newline at end of file
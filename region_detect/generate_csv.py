@@ -8,15 +8,16 @@ class Region2Csv():
     """Trans data into csv.
 
     Because we need to visualization the features used in combine regions(222-dim) 
-    and generate salience map(93-dim). So we save the features into CSV. And at 
-    last, combine all csvs to train our model.
+    and generate salience map(93-dim). So we save the features into CSV. The
+    training rows themselves go to a model.FeatureStore, see get_similar_data
+    and get_seg_data.
     """
     @staticmethod
-    def get_in_segs(rlist, seg_path):
+    def get_in_segs(regions, seg_path):
         """
         Find whether two super region in the same segs or not.
         return:
-            - in_segs: np( [num of segs, num of super_regions] ) 
+            - in_segs: np( [num of super_regions] ) 
                         if lower than 20% of region size in seg:
                             it will be -1, 
                         elif upper than 80% of region size in seg:
@@ -24,67 +25,57 @@ class Region2Csv():
                         else: 
                             it will be 0.
         """
-        in_segs = np.zeros(len(rlist))
+        in_segs = np.zeros(len(regions))
         seg = cv2.imread(seg_path)[:, :, 0]
-        _seg = np.zeros_like(seg)
-        _seg[seg == 255] = 1
-        for i in range(len(rlist)):
-            r = rlist[i]
-            in_size = np.sum(_seg[r])
-            if in_size < 0.2 * len(r[0]):
-                in_segs[i] = -1
-            elif in_size > 0.8 * len(r[0]):
-                in_segs[i] = 1
+        in_size = np.bincount(regions.rmat.reshape(-1), weights=(
+            seg == 255).reshape(-1), minlength=len(regions))
+        in_segs[in_size < 0.2 * regions.sizes] = -1
+        in_segs[in_size > 0.8 * regions.sizes] = 1
         return in_segs
 
     @staticmethod
-    def generate_similar_csv(rlist, comb_features, seg_path, csv_path):
-        in_segs = Region2Csv.get_in_segs(rlist, seg_path)
+    def get_similar_data(regions, comb_i, comb_j, comb_features, seg_path):
         """
-        Each line of CSV will be like this:
+        Each row will be like this:
             | is same_region | 222-dim features |
         """
-        data = []
-        for i, comb_f in enumerate(comb_features):
-            region_i_id = i
-            for j,  region_j_id in enumerate(comb_f["j_ids"]):
-                # at the edge
-                if in_segs[region_i_id] == 0 or in_segs[region_j_id] == 0:
-                    continue
-                # both out the seg
-                elif in_segs[region_i_id] == in_segs[region_j_id] == -1:
-                    continue
-                is_same_region = (
-                    in_segs[region_i_id] + in_segs[region_j_id])/2
-                line_data = np.zeros([1, 1 + 222])
-                line_data[0, 0] = is_same_region
-                line_data[0, 1:] = comb_f["features"][j]
-                data.append(line_data)
-        data = np.concatenate(data)
-        df = pd.DataFrame(data)
-        df.to_csv(csv_path, index=0)
+        in_segs = Region2Csv.get_in_segs(regions, seg_path)
+        in_i, in_j = in_segs[comb_i], in_segs[comb_j]
+        # not at the edge, and not both out the seg
+        keep = (in_i != 0) & (in_j != 0) & ((in_i != -1) | (in_j != -1))
+        data = np.zeros([np.sum(keep), 1 + 222])
+        data[:, 0] = (in_i[keep] + in_j[keep])/2
+        data[:, 1:] = comb_features[keep]
+        return data
 
     @staticmethod
-    def generate_seg_csv(rlist, features93, seg_path, csv_path):
-        in_segs = Region2Csv.get_in_segs(rlist, seg_path)
+    def get_seg_data(regions, features93, seg_path):
         """
-        Each line of CSV will be like this:
-            | is same_region | 93-dim features |
+        Each row will be like this:
+            | is salient | 93-dim features |
         """
-        data = []
-        for i, features in enumerate(features93):
-            # at the edge
-            line_data = np.zeros([1, 1 + 93])
-            if in_segs[i] == 0:
-                continue
-            is_seg = (in_segs[i] + 1)/2
-            line_data[0, 0] = is_seg
-            line_data[0, 1:] = features
-            data.append(line_data)
+        in_segs = Region2Csv.get_in_segs(regions, seg_path)
+        # not at the edge
+        keep = in_segs != 0
+        data = np.zeros([np.sum(keep), 1 + 93])
+        data[:, 0] = (in_segs[keep] + 1)/2
+        data[:, 1:] = features93[keep]
+        return data
+
+    @staticmethod
+    def generate_similar_csv(regions, comb_i, comb_j, comb_features, seg_path,
+                             csv_path):
+        data = Region2Csv.get_similar_data(
+            regions, comb_i, comb_j, comb_features, seg_path)
+        df = pd.DataFrame(data)
+        df.to_csv(csv_path, index=0)
+
+    @staticmethod
+    def generate_seg_csv(regions, features93, seg_path, csv_path):
+        data = Region2Csv.get_seg_data(regions, features93, seg_path)
         if len(data) == 0:
             print("got noting in {}".format(csv_path))
             return
-        data = np.concatenate(data)
         df = pd.DataFrame(data)
         df.to_csv(csv_path, index=0)
 
@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+
+
+class Img_Context():
+    """One decoded img shared by the segmentation and feature stages.
+
+    The img is decoded once and the derived planes are computed on first use,
+    so nothing reads the file again. Build it from a path, from an encoded
+    buffer (e.g. bytes from a server or a video decoder) or from an array.
+
+    Note that like cv2.imread the array is BGR, and lab, hsv and gray use the
+    same (RGB2*) conversions as the features the models were trained on.
+
+    Attributes:
+        rgb: the decoded img, np( [height, width, 3] ) uint8.
+        gray, lab, hsv: color planes of rgb.
+        blurred: rgb filtered twice by a 5x5 mean kernel, used to find super_regions.
+    """
+
+    def __init__(self, rgb):
+        self.rgb = rgb
+        self.height, self.width = rgb.shape[0:2]
+        self._gray = None
+        self._lab = None
+        self._hsv = None
+        self._blurred = None
+
+    @staticmethod
+    def from_path(path):
+        rgb = cv2.imread(path)
+        if rgb is None:
+            raise IOError("can not read img {}".format(path))
+        return Img_Context(rgb)
+
+    @staticmethod
+    def from_buffer(buffer):
+        rgb = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8),
+                           cv2.IMREAD_COLOR)
+        if rgb is None:
+            raise IOError("can not decode img buffer")
+        return Img_Context(rgb)
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+        return self._gray
+
+    @property
+    def lab(self):
+        if self._lab is None:
+            self._lab = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2Lab)
+        return self._lab
+
+    @property
+    def hsv(self):
+        if self._hsv is None:
+            self._hsv = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2HSV)
+        return self._hsv
+
+    @property
+    def blurred(self):
+        if self._blurred is None:
+            kernel = np.ones((5, 5), np.float32)/25
+            dst = cv2.filter2D(self.rgb, -1, kernel)
+            self._blurred = cv2.filter2D(dst, -1, kernel)
+        return self._blurred
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class Regions():
+    """Super regions of an img, stored as a label map plus a CSR index.
+
+    Replaces the old rlist of coordinate tuples. Region i owns the flat pixel
+    indices pixels[offsets[i]:offsets[i+1]], kept in row-major order, and
+    regions[i] gives them back as a (ys, xs) view which can index an img directly:
+        img[regions[i]]
+
+    Attributes:
+        rmat: np( [height, width] ), the region id of every pixel.
+        sizes: np( [num of regions] ), pixels in every region.
+        offsets: np( [num of regions + 1] ), CSR offsets into pixels.
+        pixels: np( [height * width] ), flat pixel indices (y * width + x)
+                grouped by region.
+        trans_array: for regions combined from other regions, the id every one
+                     of those regions got here, else None.
+    """
+
+    def __init__(self, rmat, num=None, trans_array=None):
+        self.rmat = np.ascontiguousarray(rmat, dtype=np.int32)
+        self.trans_array = trans_array
+        self.height, self.width = self.rmat.shape
+        flat = self.rmat.reshape(-1)
+        if num is None:
+            num = int(flat.max()) + 1
+        self.sizes = np.bincount(flat, minlength=num)
+        self.offsets = np.zeros(num + 1, dtype=np.int64)
+        np.cumsum(self.sizes, out=self.offsets[1:])
+        self.pixels = np.argsort(flat, kind="stable").astype(np.int32)
+        self._ys, self._xs = np.divmod(self.pixels, np.int32(self.width))
+
+    def __getstate__(self):
+        # the index is rebuilt from rmat, it is not pickled
+        return {"rmat": self.rmat, "num": len(self),
+                "trans_array": self.trans_array}
+
+    def __setstate__(self, state):
+        self.__init__(state["rmat"], state["num"], state["trans_array"])
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("region index out of range")
+        s = slice(self.offsets[i], self.offsets[i + 1])
+        return self._ys[s], self._xs[s]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def flat(self, i):
+        """Flat pixel indices of region i."""
+        return self.pixels[self.offsets[i]:self.offsets[i + 1]]
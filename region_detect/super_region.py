@@ -1,7 +1,8 @@
 import cv2
 import numpy as np
 
-from .utils import Edge, Universe
+from .regions import Regions
+from .utils import Universe
 
 MIN_REGION_SIZE = 300
 
@@ -10,136 +11,144 @@ class Super_Region():
     """Divided image into different regions.
     """
     @staticmethod
-    def guass_filter(path):
-        im = cv2.imread(path)
-        kernel = np.ones((5, 5), np.float32)/25
-        dst = cv2.filter2D(im, -1, kernel)
-        dst = cv2.filter2D(dst, -1, kernel)
-        return dst
+    def guass_filter(img):
+        return img.blurred
 
     @staticmethod
     def get_edges(im):
-        edges = []
+        """
+        Build the 8-connected pixel graph of an image.
+        args:
+            - im: the (filtered) img, like: np( [height, width, 3] )
+        return:
+            - a, b: flat pixel index (y * width + x) of the two ends of each edge
+            - weight: the color distance between a and b
+          all sorted by weight. Ties keep the order of the pixel scan
+          (right, down, down-right, up-right for each pixel).
+        """
         height = im.shape[0]
         width = im.shape[1]
-        for y in range(height):
-            for x in range(width):
-                p1 = [y, x]
-                p2_list = []
-                if x < width - 1:
-                    p2_list.append([y, x+1])
-                if y < height - 1:
-                    p2_list.append([y+1, x])
-                if x < width - 1 and y < height - 1:
-                    p2_list.append([y+1, x+1])
-                if x < width - 1 and y > 0:
-                    p2_list.append([y-1, x+1])
-                if not p2_list:
-                    pass
-                for p2 in p2_list:
-                    diff = np.sqrt(np.sum((im[y][x] - im[p2[0], p2[1]])**2))
-                    edges.append(Edge(p1, p2, diff))
-        edges.sort(key=lambda x: x.weight)
-        return edges
+        index = np.arange(height * width).reshape(height, width)
+        # (dy, dx) of the 4 forward neighbours
+        directs = [(0, 1), (1, 0), (1, 1), (-1, 1)]
+        a = np.zeros([height, width, 4], dtype=np.int64)
+        b = np.zeros([height, width, 4], dtype=np.int64)
+        weight = np.zeros([height, width, 4])
+        valid = np.zeros([height, width, 4], dtype=bool)
+        for d, (dy, dx) in enumerate(directs):
+            y0, y1 = max(0, -dy), height - max(0, dy)
+            x0, x1 = 0, width - dx
+            p1 = (slice(y0, y1), slice(x0, x1))
+            p2 = (slice(y0 + dy, y1 + dy), slice(x0 + dx, x1 + dx))
+            # keep the arithmetic in the img's dtype, same as the per-pixel version
+            diff = im[p1] - im[p2]
+            weight[p1 + (d,)] = np.sqrt(np.sum(diff**2, axis=2))
+            a[p1 + (d,)] = index[p1]
+            b[p1 + (d,)] = index[p2]
+            valid[p1 + (d,)] = True
+        valid = valid.reshape(-1)
+        a = a.reshape(-1)[valid]
+        b = b.reshape(-1)[valid]
+        weight = weight.reshape(-1)[valid]
+        order = np.argsort(weight, kind="stable")
+        return a[order], b[order], weight[order]
 
     @staticmethod
-    def get_region(path, c):
+    def get_region(img, c):
         """
-        This method will return a List which contains all super_regions.
+        This method will return all super_regions of the img.
         args:
-            - path: the img's path. like: "../data/77.jpg"
+            - img: the Img_Context of the img.
             - c: the thresholds: like: 166.
         return:
-            -rlist = [
-                        [ (y1, y2, y3,), (x1, x2, x3,) ],  # points in super_region0  
-                        ... ,
-                     ]
+            - regions: Regions, regions[i] = (ys, xs) of super_region i
         """
-        im = Super_Region.guass_filter(path)
-        edges = Super_Region.get_edges(im)
+        im = Super_Region.guass_filter(img)
+        edge_a, edge_b, edge_w = Super_Region.get_edges(im)
         height = im.shape[0]
         width = im.shape[1]
         im_size = height * width
         u = Universe(np.ones(im_size), im_size)
-        thresholds = np.ones(im_size) * c
-        for e in edges:
-            a = e.a[0] * width + e.a[1]
-            b = e.b[0] * width + e.b[1]
-            a = u.find(a)
-            b = u.find(b)
-            if a != b and e.weight <= thresholds[a] and e.weight <= thresholds[b]:
-                u.join(a, b)
-                a = u.find(a)
-                thresholds[a] = e.weight + c / u.elts[a].size
-        rlist = []
-        index = 0
-        # use index_array to map the p to index
-        index_array = np.ones(im_size, dtype=np.int32)*-1
-        for y in range(height):
-            for x in range(width):
-                p = u.find(y * width + x)
-                if index_array[p] == -1:
-                    index_array[p] = index
-                    rlist.append([(), ()])
-                    index += 1
-                rlist[index_array[p]][0] += (y,)
-                rlist[index_array[p]][1] += (x,)
-        rmat = np.zeros(im.shape[0:2], dtype=np.int32)
-        for i in range(len(rlist)):
-            rlist[i] = tuple(rlist[i])
-            rmat[rlist[i]] = i
-        return rlist, rmat
+        u.merge_edges(edge_a, edge_b, edge_w, c)
+        # regions are indexed in the order their first pixel appears
+        rmat = u.labels().reshape(height, width)
+        return Regions(rmat, u.num)
 
     @staticmethod
-    def combine_region(similarity, c, rlist, rmat):
-        num_reg = len(rlist)
-        elt_sizes = [len(r[0]) for r in rlist]
-        u = Universe(elt_sizes, num_reg)
-        thresholds = np.ones(num_reg) * c
-        for i in range(num_reg):
-            thresholds[i] /= u.elts[i].size
-        edges = []
-        for i in range(num_reg - 1):
-            for j in range(i+1, num_reg):
-                edges.append(Edge(i, j, similarity[i, j]))
-        edges.sort(key=lambda x: x.weight)
-        for e in edges:
-            a = u.find(e.a)
-            b = u.find(e.b)
-            if a != b and e.weight <= thresholds[a] and e.weight <= thresholds[b]:
-                u.join(a, b)
-                a = u.find(a)
-                thresholds[a] = e.weight + c / u.elts[a].size
+    def get_similar_edges(similarity):
+        """
+        Turn the similarity of adjacent regions into sorted region graph edges.
+        args:
+            - similarity: scipy sparse matrix [num of regions, num of regions], or
+                          an edge list (a, b, weight). Only adjacent regions are
+                          stored, an explicitly stored 0. is still an edge.
+        return:
+            - a, b, weight: the edges with a < b, sorted by weight (then a, b).
+                            A pair stored both ways is one edge, with the
+                            weight of similarity[a, b].
+        """
+        if isinstance(similarity, tuple):
+            a, b, weight = [np.asarray(x) for x in similarity]
+        else:
+            # sums the duplicates, like similarity[a, b] does
+            similarity = similarity.tocsr().tocoo()
+            a, b, weight = similarity.row, similarity.col, similarity.data
+        lower = a > b
+        a, b = np.minimum(a, b), np.maximum(a, b)
+        # one edge for every pair, its upper entry if it is stored
+        order = np.lexsort((lower, b, a))
+        a, b, weight = a[order], b[order], weight[order]
+        first = np.ones(len(a), dtype=bool)
+        first[1:] = (a[1:] != a[:-1]) | (b[1:] != b[:-1])
+        first &= a != b
+        a, b, weight = a[first], b[first], weight[first]
+        order = np.lexsort((b, a, weight))
+        return a[order], b[order], weight[order]
 
-        # force minimum size of segmentation
-        for e in edges:
-            a = u.find(e.a)
-            b = u.find(e.b)
-            if a != b and (u.elts[a].size < MIN_REGION_SIZE or u.elts[b].size < MIN_REGION_SIZE):
-                u.join(a, b)
+    @staticmethod
+    def combine_region(similarity, c, regions):
+        """
+        Merge adjacent super_regions whose similarity is under the thresholds.
+        args:
+            - similarity: the sparse similarity of adjacent regions, see get_similar_edges
+            - c: the thresholds: like: 80.
+            - regions: the Regions to combine
+        return:
+            - regions: the combined Regions
+        """
+        return Super_Region.combine_regions(similarity, [c], regions)[0]
 
-        # use index_array to map the p to index
-        index_array = np.ones(num_reg, dtype=np.int32)*-1
-        trans_array = np.zeros(num_reg)
-        index = 0
-        _rlist = []
-        for i in range(num_reg):
-            p = u.find(i)
-            if index_array[p] == -1:
-                index_array[p] = index
-                _rlist.append([(), ()])
-                index += 1
-            _rlist[index_array[p]][0] += rlist[i][0]
-            _rlist[index_array[p]][1] += rlist[i][1]
-            trans_array[i] = index_array[p]
-        _rmat = np.zeros_like(rmat)
-        for i in range(rmat.shape[0]):
-            for j in range(rmat.shape[1]):
-                _rmat[i, j] = trans_array[rmat[i, j]]
-        return _rlist, _rmat
+    @staticmethod
+    def combine_regions(similarity, c_list, regions):
+        """
+        Multi-level version of combine_region, one level for each thresholds.
+
+        All levels share one sorted edge list and one Universe, which is reset
+        in place between levels. Every level is the same as calling
+        combine_region with its c.
+        args:
+            - similarity: the sparse similarity of adjacent regions, see get_similar_edges
+            - c_list: the thresholds: like: [20, 80, 350, 900]
+            - regions: the Regions to combine
+        return:
+            - multi_regions: the combined Regions for every c in c_list
+        """
+        num_reg = len(regions)
+        u = Universe(regions.sizes, num_reg)
+        edge_a, edge_b, edge_w = Super_Region.get_similar_edges(similarity)
+        multi_regions = []
+        for c in c_list:
+            u.reset(regions.sizes)
+            u.merge_edges(edge_a, edge_b, edge_w, c)
+            # force minimum size of segmentation
+            u.merge_small(edge_a, edge_b, MIN_REGION_SIZE)
+            trans_array = u.labels()
+            multi_regions.append(Regions(
+                trans_array[regions.rmat], u.num, trans_array))
+        return multi_regions
 
     @staticmethod
-    def show_region_map(rlist, rmat):
-        disp_mat = rmat/(len(rlist) - 1)
+    def show_region_map(regions):
+        disp_mat = regions.rmat/(len(regions) - 1)
         cv2.imshow('disp_mat', disp_mat)
         cv2.waitKey(0)
@@ -1,107 +1,80 @@
 import cv2
 import numpy as np
 
-from model import RandomForest, MLP
-from feature_process import Features
-from region_detect import Super_Region, Region2Csv
+from model import RandomForest, MLP, FeatureStore
+from model.fusion_trainer import sample_pixels
+from pipeline import (C_LIST, Img_Data, extract, imap_stage, multi_seg,
+                      train_cached)
 
 TRAIN_IMGS = 500
-C_LIST = [20, 80, 350, 900]
+# max pixels of every img the fusion MLP is trained on, as many of each class,
+# None is no cap
+FUSION_PIXELS = 20000
 
 
-class Img_Data:
-    def __init__(self, img_path):
-        self.img_path = img_path
-        self.rlist, self.rmat = Super_Region.get_region(img_path, 100.)
-        features = Features(img_path, self.rlist, self.rmat)
-        self.comb_features = features.comb_features
-        self.rlists = [self.rlist]
-        self.rmats = [self.rmat]
-        self.feature93s = [features.features93]
-
-    def get_multi_segs(self, rf):
-        num_reg = len(self.rlist)
-        similarity = np.ones([num_reg, num_reg])
-        for i in range(num_reg):
-            ids = self.comb_features[i]["j_ids"]
-            X = self.comb_features[i]["features"]
-            similarity[i, ids] = rf.predict(X)[:, 0]
-        for c in C_LIST:
-            rlist, rmat = Super_Region.combine_region(
-                similarity, c, self.rlist, self.rmat)
-            if len(rlist) == 1:
-                continue
-            self.rlists.append(rlist)
-            self.rmats.append(rmat)
-            features = Features(self.img_path, rlist, rmat,
-                                need_comb_features=False)
-            self.feature93s.append(features.features93)
+def fusion_data(rf_simi_path, rf_sal_path, img_path, seg_path, random_state):
+    """
+    return:
+        - data: the rows of the fusion store of an img, sampled pixels of
+                | ground truth | salience of every level |
+                or None if it has too few levels.
+    """
+    im_data = Img_Data(img_path)
+    im_data.get_multi_segs(rf_simi_path)
+    segs_num = len(im_data.multi_regions)
+    if segs_num < len(C_LIST)+1:
+        return None
+    salience_map = im_data.get_salience_map(rf_sal_path)
+    ground_truth = cv2.imread(seg_path)[:, :, 0]
+    ground_truth[ground_truth == 255] = 1
+    ground_truth = ground_truth.reshape(-1)
+    pixels = sample_pixels(ground_truth, FUSION_PIXELS, random_state)
+    data = np.zeros([len(pixels), 1 + segs_num])
+    data[:, 0] = ground_truth[pixels]
+    data[:, 1:] = salience_map.reshape([segs_num, -1])[:, pixels].T
+    return data
 
 
 if __name__ == "__main__":
     its = [i for i in range(1, TRAIN_IMGS + 1) if i % 5 != 0]
-    csv_paths = ["data/csv/train/{}.csv".format(i) for i in its]
-    seg_csv_paths = ["data/csv/train/seg{}.csv".format(i) for i in its]
-    w_csv_paths = ["data/csv/train/w{}.csv".format(i) for i in its]
     img_paths = ["data/MSRA-B/{}.jpg".format(i) for i in its]
     seg_paths = ["data/MSRA-B/{}.png".format(i) for i in its]
-    img_datas = []
-    for i in range(len(its)):
+    train_path = "data/store/train/similar"
+    store = FeatureStore(train_path, 1 + 222, reset=True)
+    jobs = list(zip(img_paths, seg_paths))
+    for i, data in enumerate(imap_stage(extract, jobs)):
+        store.append(data)
         print("finished simi {}".format(i))
-        im_data = Img_Data(img_paths[i])
-        Region2Csv.generate_similar_csv(
-            im_data.rlist, im_data.comb_features, seg_paths[i], csv_paths[i])
-        img_datas.append(im_data)
 
-    train_csv_path = "data/csv/train/all.csv"
-    Region2Csv.combine_csv(csv_paths, train_csv_path)
-    rf_simi = RandomForest()
-    rf_simi.train(train_csv_path)
+    rf_simi = train_cached(RandomForest(), train_path, "rf_simi")
     model_path = "data/model/rf_same_region.pkl"
     rf_simi.save_model(model_path)
+    rf_simi.save_model("data/model/rf_same_region.bin", flat=True)
 
-    for i, im_data in enumerate(img_datas):
+    train_path = "data/store/train/seg"
+    store = FeatureStore(train_path, 1 + 93, reset=True)
+    rf_simi_path = "data/model/rf_same_region.bin"
+    jobs = [(rf_simi_path, img_paths[i], seg_paths[i])
+            for i in range(len(its))]
+    for i, data in enumerate(imap_stage(multi_seg, jobs)):
+        store.append(data)
         print("finished multi seg {}".format(i))
-        im_data.get_multi_segs(rf_simi)
-        csv_temp_paths = []
-        for j, rlist in enumerate(im_data.rlists):
-            temp_path = "data/csv/temp{}.csv".format(j)
-            csv_temp_paths.append(temp_path)
-            Region2Csv.generate_seg_csv(
-                rlist, im_data.feature93s[j], seg_paths[i], temp_path)
-        Region2Csv.combine_csv(csv_temp_paths, seg_csv_paths[i])
 
-    train_csv_path = "data/csv/train/seg_all.csv"
-    Region2Csv.combine_csv(seg_csv_paths, train_csv_path)
-    rf_sal = RandomForest()
-    rf_sal.train(train_csv_path)
+    rf_sal = train_cached(RandomForest(), train_path, "rf_sal")
     model_path = "data/model/rf_salience.pkl"
     rf_sal.save_model(model_path)
+    rf_sal.save_model("data/model/rf_salience.bin", flat=True)
 
-    ground_truths = []
-    salience_maps = []
-    for i, im_data in enumerate(img_datas):
+    train_path = "data/store/train/fusion"
+    store = FeatureStore(train_path, 1 + len(C_LIST) + 1, reset=True)
+    jobs = [(rf_simi_path, "data/model/rf_salience.bin", img_paths[i],
+             seg_paths[i], i) for i in range(len(its))]
+    for i, data in enumerate(imap_stage(fusion_data, jobs)):
+        if data is not None:
+            store.append(data)
         print("finish w {}".format(i))
-        segs_num = len(im_data.rlists)
-        if segs_num < len(C_LIST)+1:
-            continue
-        height = im_data.rmat.shape[0]
-        width = im_data.rmat.shape[1]
-        salience_map = np.zeros([segs_num, height, width])
-        for j, rlist in enumerate(im_data.rlists):
-            Y = rf_sal.predict(im_data.feature93s[j])[:, 1]
-            for k, r in enumerate(rlist):
-                salience_map[j][r] = Y[k]
-        ground_truth = cv2.imread(seg_paths[i])[:, :, 0]
-        ground_truth[ground_truth == 255] = 1
-        salience_maps.append(salience_map.reshape([-1, height*width]).T)
-        ground_truths.append(ground_truth.reshape(-1))
 
-    mlp = MLP()
-    X_train = np.array(salience_maps)
-    X_train = np.concatenate(X_train, axis=0)
-    Y_train = np.array(ground_truths)
-    Y_train = np.concatenate(Y_train, axis=0)
-    mlp.train(X_train, Y_train)
+    mlp = train_cached(MLP(), train_path, "mlp")
     model_path = "data/model/mlp.pkl"
     mlp.save_model(model_path)
+    mlp.save_model("data/model/mlp.bin", flat=True)
@@ -2,50 +2,58 @@ import cv2
 import numpy as np
 import pandas as pd
 
-from model import RandomForest, MLP
-from feature_process import Features
-from region_detect import Super_Region, Region2Csv
+from model import RandomForest, MLP, FeatureStore
+from pipeline import (C_LIST, Img_Data, extract, imap_stage, load_mlp,
+                      load_rf, multi_seg)
 
 import generate_noise
 
 TRAIN_IMGS = 5
-C_LIST = [20, 80, 350, 900]
-
-
-class Img_Data:
-    def __init__(self, img_path):
-        self.img_path = img_path
-        self.rlist, self.rmat = Super_Region.get_region(img_path, 100.)
-        features = Features(img_path, self.rlist, self.rmat)
-        self.comb_features = features.comb_features
-        self.rlists = [self.rlist]
-        self.rmats = [self.rmat]
-        self.feature93s = [features.features93]
-
-    def get_multi_segs(self, rf):
-        num_reg = len(self.rlist)
-        similarity = np.ones([num_reg, num_reg])
-        for i in range(num_reg):
-            ids = self.comb_features[i]["j_ids"]
-            X = self.comb_features[i]["features"]
-            similarity[i, ids] = rf.predict(X)[:, 0]
-        for c in C_LIST:
-            rlist, rmat = Super_Region.combine_region(
-                similarity, c, self.rlist, self.rmat)
-            if len(rlist) == 1:
-                continue
-            self.rlists.append(rlist)
-            self.rmats.append(rmat)
-            features = Features(self.img_path, rlist, rmat,
-                                need_comb_features=False)
-            self.feature93s.append(features.features93)
+
+
+def fusion_result(rf_simi_path, rf_sal_path, mlp_path, img_path, seg_path,
+                  result_path):
+    """
+    Save the salience map the mlp fuses from the levels of an img.
+    return:
+        - rf_sal_weight: np( [93] ), the sum over the levels of the mean
+                         contribution of every feature to the salience.
+        - segs_num: num of levels
+        - x: np( [num of pixels, num of levels] ), the salience of every level.
+        - ground_truth: np( [num of pixels] )
+        or None if it has too few levels.
+    """
+    im_data = Img_Data(img_path)
+    im_data.get_multi_segs(rf_simi_path)
+    segs_num = len(im_data.multi_regions)
+    if segs_num < len(C_LIST)+1:
+        return None
+    height = im_data.regions.rmat.shape[0]
+    width = im_data.regions.rmat.shape[1]
+    # one sklearn rf for the salience and its weights
+    salience_map = im_data.get_salience_map(rf_sal_path, flat=False)
+    rf_sal = load_rf(rf_sal_path, flat=False)
+    rf_sal_weight = np.zeros(93)
+    for features93 in im_data.feature93s:
+        _, _, weights = rf_sal.get_weights(features93)
+        rf_sal_weight += np.mean(weights, axis=0)[:, 1]
+
+    ground_truth = cv2.imread(seg_path)[:, :, 0]
+    ground_truth[ground_truth == 255] = 1
+    x = salience_map.reshape([-1, height*width]).T
+
+    result = load_mlp(mlp_path).predict_map(
+        salience_map, [r.rmat for r in im_data.multi_regions])
+    result = result.reshape([height, width, 1])
+    result[result>0.5] = 255
+    result[result<=0.5] = 0
+    cv2.imwrite(result_path, result.astype(np.uint8))
+    return rf_sal_weight, segs_num, x, ground_truth.reshape(-1)
 
 
 if __name__ == "__main__":
     # its = [i for i in range(1, TRAIN_IMGS + 1) if i % 5 == 0]
     its = [i for i in range(3001, 3021)]
-    csv_paths = ["data/csv/val/{}.csv".format(i) for i in its]
-    seg_csv_paths = ["data/csv/val/seg{}.csv".format(i) for i in its]
     # img_paths = ["data/MSRA-B/{}.jpg".format(i) for i in its]
     # img_paths = ["./val_pic/sp_{}.jpg".format(i) for i in its]
     # img_paths = ["./denoise/de_spnoise_{}.jpg".format(i) for i in its]
@@ -55,74 +63,56 @@ if __name__ == "__main__":
     img_paths = ["./denoise/de_specklenoise_{}.jpg".format(i) for i in its]
 
     seg_paths = ["data/MSRA-B/{}.png".format(i) for i in its]
-    img_datas = []
-    for i in range(len(its)):
-        im_data = Img_Data(img_paths[i])
-        Region2Csv.generate_similar_csv(
-            im_data.rlist, im_data.comb_features, seg_paths[i], csv_paths[i])
-        img_datas.append(im_data)
+    val_path = "data/store/val/similar"
+    store = FeatureStore(val_path, 1 + 222, reset=True)
+    jobs = list(zip(img_paths, seg_paths))
+    for i, data in enumerate(imap_stage(extract, jobs)):
+        store.append(data)
         print("finished simi {}".format(i))
 
-    val_csv_path = "data/csv/val/all.csv"
-    Region2Csv.combine_csv(csv_paths, val_csv_path)
     rf_simi = RandomForest()
     model_path = "data/model/rf_same_region.pkl"
+    # sklearn is faster on the whole store, the workers predict every img
+    # with its FlatForest, converted once here
     rf_simi.load_model(model_path)
-    rf_simi.test(val_csv_path)
-
-    for i, im_data in enumerate(img_datas):
-        im_data.get_multi_segs(rf_simi)
-        csv_temp_paths = []
-        for j, rlist in enumerate(im_data.rlists):
-            temp_path = "data/csv/temp{}.csv".format(j)
-            csv_temp_paths.append(temp_path)
-            Region2Csv.generate_seg_csv(
-                rlist, im_data.feature93s[j], seg_paths[i], temp_path)
-        Region2Csv.combine_csv(csv_temp_paths, seg_csv_paths[i])
+    rf_simi.test(val_path)
+    rf_simi_path = "data/model/rf_same_region.bin"
+    rf_simi.save_model(rf_simi_path, flat=True)
+
+    val_path = "data/store/val/seg"
+    store = FeatureStore(val_path, 1 + 93, reset=True)
+    jobs = [(rf_simi_path, img_paths[i], seg_paths[i])
+            for i in range(len(its))]
+    for i, data in enumerate(imap_stage(multi_seg, jobs)):
+        store.append(data)
         print("finished multi seg {}".format(i))
 
-    val_csv_path = "data/csv/val/seg_all.csv"
-    Region2Csv.combine_csv(seg_csv_paths, val_csv_path)
     rf_sal = RandomForest()
     model_path = "data/model/rf_salience.pkl"
     rf_sal.load_model(model_path)
-    rf_sal.test(val_csv_path)
+    rf_sal.test(val_path)
 
     mlp = MLP()
     model_path = "data/model/mlp.pkl"
     mlp.load_model(model_path)
+    mlp_path = "data/model/mlp.bin"
+    mlp.save_model(mlp_path, flat=True)
 
     ground_truths = []
     salience_maps = []
     rf_sal_weight = np.zeros(93)
-    for i, im_data in enumerate(img_datas):
-        segs_num = len(im_data.rlists)
-        if segs_num < len(C_LIST)+1:
+    # rf_sal is unpickled once by every worker, get_weights needs sklearn
+    jobs = [(rf_simi_path, "data/model/rf_salience.pkl", mlp_path,
+             img_paths[i], seg_paths[i], "data/result/{}.png".format(its[i]))
+            for i in range(len(its))]
+    for i, result in enumerate(imap_stage(fusion_result, jobs)):
+        if result is None:
             continue
-        height = im_data.rmat.shape[0]
-        width = im_data.rmat.shape[1]
-        salience_map = np.zeros([segs_num, height, width])
-        for j, rlist in enumerate(im_data.rlists):
-            Y = rf_sal.predict(im_data.feature93s[j])[:, 1]
-            for k, r in enumerate(rlist):
-                salience_map[j][r] = Y[k]
-        
-            _, _, weights = rf_sal.get_weights(im_data.feature93s[j])
-            rf_sal_weight += np.mean(weights, axis=0)[:, 1]
-        
-        rf_sal_weight /= len(im_data.rlists)
-
-        ground_truth = cv2.imread(seg_paths[i])[:, :, 0]
-        ground_truth[ground_truth == 255] = 1
-        x = salience_map.reshape([-1, height*width]).T
+        weight, segs_num, x, ground_truth = result
+        rf_sal_weight += weight
+        rf_sal_weight /= segs_num
         salience_maps.append(x)
-        ground_truths.append(ground_truth.reshape(-1))
-
-        result = mlp.predict(x).reshape([height, width, 1])
-        result[result>0.5] = 255
-        result[result<=0.5] = 0
-        cv2.imwrite("data/result/{}.png".format(its[i]), result.astype(np.uint8))
-        
+        ground_truths.append(ground_truth)
         print("finish w {}".format(i))
 
     X_test = np.array(salience_maps)
@@ -131,5 +121,5 @@ if __name__ == "__main__":
     Y_test = np.concatenate(Y_test, axis=0)
     mlp.test(X_test, Y_test)
 
-    df = pd.DataFrame(rf_sal_weight/len(img_datas))
+    df = pd.DataFrame(rf_sal_weight/len(its))
     df.to_csv("data/csv/rf_sal_weight.csv")